@@ -8,10 +8,11 @@ SoftwareSerial fingerprint_serial = SoftwareSerial(2, 3);
 FingerprintModule finger = FingerprintModule(&fingerprint_serial);
 ConfirmationCode buffer_code;
 uint8_t buffer_byte[3];
+uint32_t baud_rate = BaudRates[0];
 
 void setup()
 {
-    Serial.begin(57600);
+    Serial.begin(baud_rate);
     while (!Serial)
         ;
     delay(100);
@@ -45,7 +46,10 @@ void loop()  // run over and over again
             try_to_get_image();
             break;
         case CommandCode::UpImage:
-            upload_image();
+            upload_image(false);
+            break;
+        case CommandCode::UpImageCompressed:
+            upload_image(true);
             break;
         case CommandCode::PrintDeviceParameters:
             finger.read_parameters();
@@ -55,6 +59,9 @@ void loop()  // run over and over again
         case CommandCode::WriteReg:
             write_reg();
             break;
+        case CommandCode::SetBaudRate:
+            set_baud_rate();
+            break;
 
         default:
             Serial.write(DeviceState::CommandFailed);
@@ -80,7 +87,7 @@ void try_to_get_image()
     }
 }
 
-void upload_image()
+void upload_image(bool compressed)
 {
     buffer_code = finger.up_image();
 
@@ -103,10 +110,14 @@ void upload_image()
             return;
         }
 
-        Serial.write(DeviceState::DataStart);
-        Serial.write(packet.length - 2);
-        Serial.write(packet.data, packet.length - 2);
-        Serial.write(DeviceState::DataEnd);
+        if (compressed) {
+            write_compressed(packet.data, packet.length - 2);
+        } else {
+            Serial.write(DeviceState::DataStart);
+            Serial.write(packet.length - 2);
+            Serial.write(packet.data, packet.length - 2);
+            Serial.write(DeviceState::DataEnd);
+        }
 
         if (packet.type == PacketType::EndOfDataPacket) {
             Serial.write(DeviceState::CommandSuccess);
@@ -115,6 +126,81 @@ void upload_image()
     }
 }
 
+uint8_t pixel_at(const uint8_t *data, uint16_t i)
+{
+    return i % 2 ? data[i / 2] & 0x0F : data[i / 2] >> 4;
+}
+
+uint8_t delta_code(uint8_t delta)
+{
+    switch (delta) {
+        case 0x00:
+            return 0;
+        case 0x01:
+            return 1;
+        case 0x0F:
+            return 3;
+        default:
+            return DeltaEscape;
+    }
+}
+
+// Send a packet as the difference of each pixel to the previous one, modulo
+// 16: its length, a 2-bit code per pixel, then the escaped differences as
+// nibbles. The packet is walked once per part, so no buffer is needed.
+void write_compressed(const uint8_t *data, uint8_t length)
+{
+    uint16_t n_pixels = 2 * length;
+    uint16_t n_escapes = 0;
+    uint8_t previous = 0;
+    for (uint16_t i = 0; i < n_pixels; i++) {
+        uint8_t pixel = pixel_at(data, i);
+        n_escapes += delta_code((pixel - previous) & 0x0F) == DeltaEscape;
+        previous = pixel;
+    }
+
+    Serial.write(DeviceState::CompressedData);
+    Serial.write(1 + (n_pixels + 3) / 4 + (n_escapes + 1) / 2);
+    Serial.write(length);
+
+    uint8_t byte = 0;
+    previous = 0;
+    for (uint16_t i = 0; i < n_pixels; i++) {
+        uint8_t pixel = pixel_at(data, i);
+        byte = byte << 2 | delta_code((pixel - previous) & 0x0F);
+        previous = pixel;
+        if (i % 4 == 3) {
+            Serial.write(byte);
+            byte = 0;
+        }
+    }
+    if (n_pixels % 4) {
+        Serial.write(byte << 2 * (4 - n_pixels % 4));
+    }
+
+    byte = 0;
+    uint16_t n_written = 0;
+    previous = 0;
+    for (uint16_t i = 0; i < n_pixels; i++) {
+        uint8_t pixel = pixel_at(data, i);
+        uint8_t delta = (pixel - previous) & 0x0F;
+        previous = pixel;
+        if (delta_code(delta) != DeltaEscape) {
+            continue;
+        }
+        byte = byte << 4 | delta;
+        if (++n_written % 2 == 0) {
+            Serial.write(byte);
+            byte = 0;
+        }
+    }
+    if (n_written % 2) {
+        Serial.write(byte << 4);
+    }
+
+    Serial.write(DeviceState::DataEnd);
+}
+
 void write_reg()
 {
     while (Serial.available() < 2) {
@@ -128,3 +214,35 @@ void write_reg()
                                             : DeviceState::CommandFailed
     );
 }
+
+void set_baud_rate()
+{
+    while (Serial.available() < 1) {
+        delay(1);
+    }
+    buffer_byte[1] = Serial.read();
+    if (buffer_byte[1] >= BaudRateCount) {
+        Serial.write(DeviceState::CommandFailed);
+        return;
+    }
+
+    // Confirm at the old rate, then switch and wait for the host to
+    // acknowledge at the new one; fall back if it never does
+    Serial.write(DeviceState::CommandSuccess);
+    Serial.flush();
+    Serial.end();
+    Serial.begin(BaudRates[buffer_byte[1]]);
+
+    unsigned long start = millis();
+    while (millis() - start < BaudRateAckTimeout) {
+        if (Serial.available() &&
+            Serial.read() == CommandCode::Acknowledgement) {
+            baud_rate = BaudRates[buffer_byte[1]];
+            Serial.write(DeviceState::CommandSuccess);
+            return;
+        }
+    }
+
+    Serial.end();
+    Serial.begin(baud_rate);
+}
@@ -0,0 +1,457 @@
+import argparse
+import asyncio
+import time
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import serial
+from PIL import Image
+
+from as608_protocol import (
+    BAUD_RATE_ACK_TIMEOUT,
+    BAUD_RATES,
+    Command,
+    DeviceState,
+    ProtocolError,
+    UpImageReceiver,
+    state_name,
+)
+from image_codec import unpack_nibbles
+
+# Silence on the line that ends the rest of an interrupted upload
+UPLOAD_DRAIN_IDLE = 0.5
+
+
+class AS608Client:
+    """
+    asyncio client for the Control.ino protocol.
+
+    The serial port is put in non-blocking mode and watched by the event
+    loop (`loop.add_reader`), so waiting for the sensor costs nothing and
+    any number of clients can share one loop. On platforms whose loop
+    cannot watch serial ports a reader thread blocking in the OS fills the
+    buffer instead. Every command takes a `timeout` in seconds, raising
+    `asyncio.TimeoutError` when it expires. Once the port fails, for
+    instance when the device is unplugged, reading stops and every
+    command raises `serial.SerialException` until the client is reopened.
+    """
+
+    def __init__(
+        self,
+        port_name: str,
+        image_dimension: tuple[int, int] = (256, 288),
+        timeout: float = 10.0,
+    ):
+        self.port_name = port_name
+        self.image_dimension = image_dimension
+        self.n_image_bytes = image_dimension[0] * image_dimension[1] // 2
+        self.timeout = timeout
+        self.receiver = UpImageReceiver(self.n_image_bytes)
+
+        self.ser: Optional[serial.Serial] = None
+        self._buffer = bytearray()
+        self._data_ready = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._pump_task: Optional[asyncio.Task] = None
+        self._watching_fd = False
+        # Why the port stopped being read, raised by every later read
+        self._error: Optional[OSError] = None
+
+    async def __aenter__(self) -> "AS608Client":
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    async def open(
+        self, baud_rate: int = BAUD_RATES[0], timeout: Optional[float] = None
+    ) -> None:
+        """Open the port, wait for the sketch to initialize the sensor"""
+        self.ser = serial.Serial(self.port_name, BAUD_RATES[0], timeout=0)
+        self._buffer.clear()
+        self._error = None
+        self._start_reading()
+
+        async def wait_for_init():
+            while True:
+                state = await self._read_state()
+                if state == DeviceState.InitializationComplete:
+                    return
+                if state == DeviceState.InitializationFailed:
+                    raise ProtocolError("Initialization failed.")
+
+        # __aexit__ does not run when __aenter__ fails, release the port here
+        try:
+            await asyncio.wait_for(wait_for_init(), self._timeout(timeout))
+            if baud_rate != BAUD_RATES[0]:
+                await self.set_baud_rate(baud_rate, timeout)
+        except BaseException:
+            await self.close()
+            raise
+
+    async def close(self) -> None:
+        if self.ser is None:
+            return
+        self._stop_watching()
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            self._pump_task = None
+        self.ser.close()
+        self.ser = None
+
+    def _timeout(self, timeout: Optional[float]) -> float:
+        return self.timeout if timeout is None else timeout
+
+    def _start_reading(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            loop.add_reader(self.ser.fileno(), self._on_readable)
+            self._watching_fd = True
+        except (AttributeError, NotImplementedError):
+            self._pump_task = loop.create_task(self._pump())
+
+    def _stop_watching(self) -> None:
+        if self._watching_fd:
+            asyncio.get_running_loop().remove_reader(self.ser.fileno())
+            self._watching_fd = False
+
+    def _fail(self, error: OSError) -> None:
+        """
+        The port cannot be read anymore: stop watching it, otherwise the
+        loop calls back forever on the readable fd, and wake up the readers
+        """
+        self._stop_watching()
+        self._error = error
+        self._data_ready.set()
+
+    def _on_readable(self) -> None:
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException, OSError) as e:
+            self._fail(e)
+            return
+        if data:
+            self._buffer += data
+            self._data_ready.set()
+
+    async def _pump(self) -> None:
+        self.ser.timeout = 0.1
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                data = await loop.run_in_executor(
+                    None, lambda: self.ser.read(self.ser.in_waiting or 1)
+                )
+            except (serial.SerialException, OSError) as e:
+                self._fail(e)
+                return
+            if data:
+                self._buffer += data
+                self._data_ready.set()
+
+    def _check_port(self) -> None:
+        if self._error is not None:
+            raise serial.SerialException(
+                f"{self.port_name}: port lost ({self._error})"
+            ) from self._error
+
+    async def _read_some(self, idle_timeout: Optional[float] = None) -> bytes:
+        """
+        Everything buffered so far, waiting for at least one byte, for at
+        most `idle_timeout` seconds
+        """
+        loop = asyncio.get_running_loop()
+        timer = None
+        if idle_timeout is not None:
+            # A timer rather than asyncio.wait_for, which can swallow the
+            # task's cancellation when a byte arrives at the same time
+            deadline = loop.time() + idle_timeout
+            timer = loop.call_at(deadline, self._data_ready.set)
+        try:
+            while not self._buffer:
+                self._check_port()
+                if timer is not None and loop.time() >= deadline:
+                    raise asyncio.TimeoutError()
+                self._data_ready.clear()
+                await self._data_ready.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def _unread(self, data: bytes) -> None:
+        self._buffer[:0] = data
+
+    async def _read_byte(self, idle_timeout: Optional[float] = None) -> int:
+        data = await self._read_some(idle_timeout)
+        self._unread(data[1:])
+        return data[0]
+
+    async def _read_state(
+        self, idle_timeout: Optional[float] = None
+    ) -> DeviceState:
+        byte = await self._read_byte(idle_timeout)
+        try:
+            return DeviceState(byte)
+        except ValueError:
+            raise ProtocolError(f"Unknown state byte {state_name(byte)}")
+
+    async def _expect_success(self) -> None:
+        state = await self._read_state()
+        if state != DeviceState.CommandSuccess:
+            raise ProtocolError(f"Command failed ({state})")
+
+    def _send(self, *data: int | Command) -> None:
+        self._check_port()
+        self._buffer.clear()
+        self.ser.reset_input_buffer()
+        self.ser.write(
+            bytes(d.value if isinstance(d, Command) else d for d in data)
+        )
+
+    async def get_image(
+        self,
+        timeout: Optional[float] = None,
+        wait_for_lift: bool = False,
+        idle_timeout: Optional[float] = None,
+    ) -> None:
+        """
+        Wait for a finger and capture its image into the sensor buffer.
+        With `wait_for_lift`, as `as608_protocol.capture_image`, a finger
+        still resting on the sensor is ignored until it has been lifted.
+
+        The sketch reports NoFingerDetected on every poll of the sensor, so
+        a live link is never silent for long: with `idle_timeout`,
+        `asyncio.TimeoutError` is raised once no state has been received
+        for that many seconds, however long `timeout` is.
+        """
+
+        async def get_image():
+            self._send(Command.GetImage)
+            finger_lifted = not wait_for_lift
+            while True:
+                state = await self._read_state(idle_timeout)
+                if state == DeviceState.NoFingerDetected:
+                    finger_lifted = True
+                    continue
+                if state != DeviceState.CommandSuccess:
+                    raise ProtocolError(f"Command failed ({state})")
+                if finger_lifted:
+                    return
+                self._send(Command.GetImage)
+
+        async with self._lock:
+            await asyncio.wait_for(get_image(), self._timeout(timeout))
+
+    async def iter_image_chunks(
+        self, timeout: Optional[float] = None
+    ) -> AsyncIterator[memoryview]:
+        """
+        Upload the captured image, yielding each frame's payload as soon as
+        it arrives. The views point into `self.receiver.image` and stay
+        valid until the next upload. `timeout` bounds the wait per read.
+
+        Stopping early is allowed: the rest of the image is then read and
+        discarded when the generator is closed, before the next command
+        runs. Use `contextlib.aclosing` to close it right away.
+        """
+        chunks: list[tuple[int, int]] = []
+
+        def on_chunk(start: int, stop: int) -> None:
+            chunks.append((start, stop))
+
+        async with self._lock:
+            self._send(Command.UpImage)
+            self.receiver.reset()
+            start = None
+            try:
+                while not self.receiver.done:
+                    data = await asyncio.wait_for(
+                        self._read_some(), self._timeout(timeout)
+                    )
+                    if start is None:
+                        start = time.perf_counter()
+                    used = self.receiver.feed(data, on_chunk)
+                    self.receiver.n_wire_bytes += used
+                    self._unread(data[used:])
+
+                    for chunk_start, chunk_stop in chunks:
+                        yield self.receiver.image_view[chunk_start:chunk_stop]
+                    chunks.clear()
+            finally:
+                if not self.receiver.done:
+                    await self._drain_upload(timeout)
+            self.receiver.elapsed = time.perf_counter() - start
+
+        if self.receiver.n_received != self.n_image_bytes:
+            raise ProtocolError(
+                f"Image size mismatch ({self.receiver.n_received} bytes)"
+            )
+
+    async def _drain_upload(self, timeout: Optional[float]) -> None:
+        """
+        Consume the rest of an interrupted upload, so that its frames are
+        not taken for the reply to the next command. The frames are
+        followed up to the end of the image while they can be parsed,
+        otherwise input is dropped until the line goes quiet.
+        """
+
+        async def drain():
+            following = True
+            while not (following and self.receiver.done):
+                data = await asyncio.wait_for(
+                    self._read_some(), UPLOAD_DRAIN_IDLE
+                )
+                if not following:
+                    continue
+                try:
+                    self._unread(data[self.receiver.feed(data) :])
+                except ProtocolError:
+                    following = False
+
+        try:
+            await asyncio.wait_for(drain(), self._timeout(timeout))
+        except (OSError, asyncio.TimeoutError):
+            # A stalled sensor or a lost port, nothing more will come
+            self._buffer.clear()
+
+    async def up_image(self, timeout: Optional[float] = None) -> bytes:
+        """Upload the captured image as packed 4-bit pixels"""
+
+        async def up_image():
+            async for _ in self.iter_image_chunks():
+                pass
+            return bytes(self.receiver.image)
+
+        return await asyncio.wait_for(up_image(), self._timeout(timeout))
+
+    async def write_reg(
+        self, address: int, value: int, timeout: Optional[float] = None
+    ) -> None:
+        async with self._lock:
+            self._send(Command.WriteReg, address, value)
+            await asyncio.wait_for(
+                self._expect_success(), self._timeout(timeout)
+            )
+
+    async def read_parameters(
+        self, timeout: Optional[float] = None
+    ) -> dict[str, str]:
+        """The sensor's system parameters, as printed by the sketch"""
+
+        async def read_parameters():
+            text = bytearray()
+            while True:
+                data = await self._read_some()
+                end = data.find(DeviceState.CommandSuccess.value)
+                if end < 0:
+                    text += data
+                    continue
+                text += data[:end]
+                self._unread(data[end + 1 :])
+                break
+
+            return dict(
+                line.split(": ", 1)
+                for line in text.decode("utf-8").splitlines()
+                if ": " in line
+            )
+
+        async with self._lock:
+            self._send(Command.PrintDeviceParameters)
+            return await asyncio.wait_for(
+                read_parameters(), self._timeout(timeout)
+            )
+
+    async def set_baud_rate(
+        self, baud_rate: int, timeout: Optional[float] = None
+    ) -> int:
+        """Async counterpart of `as608_protocol.negotiate_baud_rate`"""
+        if baud_rate not in BAUD_RATES:
+            raise ValueError(f"Unsupported baud rate: {baud_rate}")
+        if baud_rate == self.ser.baudrate:
+            return baud_rate
+
+        old_baud_rate = self.ser.baudrate
+        async with self._lock:
+            self._send(Command.SetBaudRate, BAUD_RATES.index(baud_rate))
+            try:
+                await asyncio.wait_for(
+                    self._expect_success(), self._timeout(timeout)
+                )
+            except (ProtocolError, asyncio.TimeoutError):
+                return old_baud_rate
+
+            start = time.monotonic()
+            self.ser.baudrate = baud_rate
+            self._send(Command.Acknowledgement)
+            try:
+                await asyncio.wait_for(
+                    self._expect_success(), BAUD_RATE_ACK_TIMEOUT / 2
+                )
+                return baud_rate
+            except (ProtocolError, asyncio.TimeoutError):
+                pass
+
+            await asyncio.sleep(
+                max(0.0, start + BAUD_RATE_ACK_TIMEOUT - time.monotonic())
+            )
+            self.ser.baudrate = old_baud_rate
+            self._buffer.clear()
+            return old_baud_rate
+
+
+async def capture(
+    port_name: str, out_dir: Path, baud_rate: int, raw: bool = False
+) -> None:
+    async with AS608Client(port_name) as client:
+        if baud_rate != BAUD_RATES[0]:
+            await client.set_baud_rate(baud_rate)
+        print(f"{port_name}: place your finger on the sensor")
+        await client.get_image(timeout=60)
+        image_bytes = await client.up_image()
+        print(
+            f"{port_name}: image received "
+            f"({client.receiver.throughput / 1024:.1f} KiB/s)"
+        )
+
+    if raw:
+        (out_dir / f"{Path(port_name).name}.raw").write_bytes(image_bytes)
+        return
+    image = Image.fromarray(unpack_nibbles(image_bytes))
+    image.save(out_dir / f"{Path(port_name).name}.bmp")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Capture one image from each of several sensors at once"
+    )
+    parser.add_argument("ports", nargs="+", help="serial ports to use")
+    parser.add_argument("-o", "--out-dir", type=Path, default=Path("."))
+    parser.add_argument(
+        "--baud", type=int, choices=BAUD_RATES, default=BAUD_RATES[0]
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="save the packed 4-bit payload as received, not a BMP",
+    )
+    args = parser.parse_args()
+
+    results = await asyncio.gather(
+        *(
+            capture(port, args.out_dir, args.baud, args.raw)
+            for port in args.ports
+        ),
+        return_exceptions=True,
+    )
+    for port, result in zip(args.ports, results):
+        if isinstance(result, Exception):
+            print(f"{port}: {result!r}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,15 @@
-from enum import Enum
+import argparse
+import queue
+import threading
+import time
 from typing import Optional
 from pathlib import Path
 
-import cv2
+import numpy as np
 import serial
+from numpy.typing import NDArray
 
-from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtCore import QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QFont
 from PyQt6.QtWidgets import (
     QApplication,
@@ -21,196 +25,379 @@ from PyQt6.QtWidgets import (
     QLineEdit,
 )
 
-from fingerprint_matcher import Fingerprint, match_minutiae
-from utils import decode_image, to_pixmap, find_arduino_port
+from as608_protocol import (
+    BAUD_RATES,
+    Command,
+    DeviceState,
+    ProtocolError,
+    UpImageReceiver,
+    capture_image,
+    negotiate_baud_rate,
+    wait_for_initialization,
+)
+from fingerprint_matcher import Fingerprint, capture_path, load_capture
+from image_codec import unpack_nibbles_into
+from image_quality import assess_quality
+from profiling import profiler
+from template_cache import TemplateCache
+from template_index import TemplateIndex
+from utils import to_pixmap, find_arduino_port
 
 script_dir = Path(__file__).parent.resolve()
 db_dir = script_dir / "db"
 db_dir.mkdir(exist_ok=True)
-
-
-class DeviceState(Enum):
-    Initialization = 0x00
-    InitializationComplete = 0x01
-    InitializationFailed = 0x02
-    CommandSuccess = 0x03
-    CommandFailed = 0x04
-    CommandTimeout = 0x05
-    NoFingerDetected = 0x06
-    DataStart = 0x07
-    DataEnd = 0x08
-    Idle = 0x69
-
-    def __str__(self):
-        return self.name
-
-
-class Command(Enum):
-    GetImage = b"\x01"
-    UpImage = b"\x0A"
-    WriteReg = b"\x0E"
-
-    Acknowledgement = b"\x30"
-    PrintDeviceParameters = b"\x32"
-
-    def __str__(self):
-        return self.name
+# Repeat scans and redisplayed matches skip the pipeline entirely
+template_cache = TemplateCache(disk_dir=script_dir / "cache", keep_images=True)
+template_index = TemplateIndex(db_dir, template_cache)
 
 
 class AS608Thread(QThread):
     image_dimension = (256, 288)
     n_image_bytes = image_dimension[0] * image_dimension[1] // 2
+    # Minimum seconds between two previews of a partial image
+    preview_interval = 0.1
+    # Seconds between two scans of the database for templates enrolled by
+    # other processes, the window adds its own enrollments right away
+    refresh_interval = 30.0
 
     update_status = pyqtSignal(str)
     update_message = pyqtSignal(str)
     update_fp_grid = pyqtSignal(Fingerprint, int)
+    update_preview = pyqtSignal(np.ndarray)
     update_pbar_value = pyqtSignal(int)
     update_pbar_range = pyqtSignal(int, int)
     update_pbar_format = pyqtSignal(str)
 
     toggle_name_input = pyqtSignal(bool)
 
-    def __init__(self):
+    def __init__(
+        self,
+        baud_rate: int = BAUD_RATES[0],
+        kiosk: bool = False,
+        queue_size: int = 1,
+        port_name: Optional[str] = None,
+        compressed: bool = False,
+    ):
         super().__init__()
-        self.ser = serial.Serial(find_arduino_port().device, 57600, timeout=1)
+        if port_name is None:
+            port_name = find_arduino_port().device
+        self.ser = serial.Serial(port_name, BAUD_RATES[0], timeout=1)
+        self.baud_rate = baud_rate
+        # Ask the sketch for delta-compressed image frames
+        self.compressed = compressed
+        self.receiver = UpImageReceiver(self.n_image_bytes)
         self.current_fp: Optional[Fingerprint] = None
         self.initialized = False
 
-    def init_as608(self):
-        while True:
-            state_byte = self.ser.read(1)
-            if not state_byte:
-                continue
+        self.kiosk = kiosk
+        # Each capture with the time its GetImage was sent, None once the
+        # capture loop has stopped
+        self.captures: queue.Queue[Optional[tuple[NDArray, float]]] = (
+            queue.Queue(queue_size)
+        )
+        # Checked by every loop of both threads, see `stop`
+        self.stopped = threading.Event()
 
-            state = DeviceState(state_byte[0])
+        # Decoded progressively while the image is being uploaded
+        self.preview = np.zeros(
+            (self.image_dimension[1], self.image_dimension[0]), dtype=np.uint8
+        )
+        self.abort_requested = threading.Event()
+        # Running average of the time spent building a Fingerprint, to
+        # report what rejecting a poor capture up front saves
+        self.pipeline_time: Optional[float] = None
+
+    def abort_download(self):
+        """Discard the image currently being uploaded"""
+        self.abort_requested.set()
+
+    def init_as608(self):
+        def on_state(state: DeviceState):
             if state == DeviceState.Initialization:
                 self.update_status.emit("Initializing")
             elif state == DeviceState.InitializationComplete:
                 self.update_status.emit("Initialization complete.")
-                break
-            elif state == DeviceState.InitializationFailed:
-                raise Exception("Initialization failed.")
+
+        if not wait_for_initialization(self.ser, on_state, self.stopped):
+            return
+
+        if self.baud_rate != self.ser.baudrate:
+            effective = negotiate_baud_rate(self.ser, self.baud_rate)
+            self.update_status.emit(f"Link running at {effective} baud")
 
         self.initialized = True
 
     def run(self):
         if not self.initialized:
             self.init_as608()
+            if not self.initialized:
+                return
+
+        # Once per session rather than per identification, while the user
+        # is still placing a finger
+        template_index.refresh()
+
+        if self.kiosk:
+            self.run_kiosk()
+            return
 
         self.update_pbar_range.emit(0, 0)
         self.update_pbar_format.emit("")
-        self.get_fingerprint_image()
+        started = time.perf_counter()
+        if not self.get_fingerprint_image():
+            return
 
         self.update_pbar_range.emit(0, self.n_image_bytes)
         self.update_pbar_format.emit("%v/%m")
         self.update_pbar_value.emit(0)
 
-        self.upload_fingerprint_image()
+        if not self.upload_fingerprint_image():
+            return
 
         self.update_pbar_range.emit(0, 0)
         self.update_pbar_format.emit("")
 
         self.match_fingerprint()
+        profiler.record("end_to_end", time.perf_counter() - started)
 
         self.update_pbar_range.emit(0, 1)
         self.update_pbar_value.emit(1)
 
-    def get_fingerprint_image(self):
-        self.ser.write(Command.GetImage.value)
-        self.update_message.emit("Place your finger on the sensor")
-        self.update_status.emit("Capturing finger image")
+    def run_kiosk(self):
+        """
+        Identify finger after finger without a restart. This thread only
+        talks to the sensor and hands every image to a matcher thread
+        through the bounded `captures` queue, so the next finger is already
+        being captured while the previous one is enhanced and matched.
+        """
+        matcher = threading.Thread(target=self.match_captures, daemon=True)
+        matcher.start()
+        refresher = threading.Thread(
+            target=self.refresh_templates, daemon=True
+        )
+        refresher.start()
 
         try:
-            while True:
-                response = self.ser.read(1)
-                if not response:
+            while not self.stopped.is_set():
+                self.update_pbar_range.emit(0, 0)
+                self.update_pbar_format.emit("")
+                started = time.perf_counter()
+                if not self.get_fingerprint_image(wait_for_lift=True):
                     continue
 
-                response_state = DeviceState(response[0])
-                if response_state == DeviceState.NoFingerDetected:
-                    continue
-
-                if response_state != DeviceState.CommandSuccess:
-                    raise ValueError("Command failed")
+                self.update_pbar_range.emit(0, self.n_image_bytes)
+                self.update_pbar_format.emit("%v/%m")
+                image = self.download_image()
+                if image is not None and self.check_quality(image):
+                    self.captures.put((image, started))
+        finally:
+            # The session is over, whatever ended it
+            self.stopped.set()
+            self.captures.put(None)
+            matcher.join()
+            refresher.join()
+
+    def refresh_templates(self):
+        """Pick up templates enrolled elsewhere during a kiosk session"""
+        while not self.stopped.wait(self.refresh_interval):
+            try:
+                template_index.refresh()
+            except Exception as e:
+                # The templates loaded so far keep being matched
+                self.update_status.emit(f"Failed to refresh templates ({e})")
+
+    def match_captures(self):
+        while (capture := self.captures.get()) is not None:
+            if self.stopped.is_set():
+                continue  # Left over from the session being stopped
+            image, started = capture
+
+            # One bad capture must not stop the matcher, or the capture
+            # loop blocks forever on the full queue
+            try:
+                self.current_fp = self.build_fingerprint(image)
+                self.update_fp_grid.emit(self.current_fp, 0)
+                self.match_fingerprint()
+            except Exception as e:
+                profiler.count("match_errors")
+                self.update_message.emit(
+                    f"Failed to process the capture. Please try again. ({e})"
+                )
+                self.update_status.emit("Matching failed")
+                continue
+            profiler.record("end_to_end", time.perf_counter() - started)
+
+    def stop(self):
+        """
+        Stop both threads between two sensor reads, dropping the captures
+        still queued, then close the port. Nothing is left mid-transfer:
+        the port is only closed once the threads are done with it.
+        """
+        self.stopped.set()
+        self.wait()
+        self.ser.close()
+
+    def get_fingerprint_image(self, wait_for_lift: bool = False) -> bool:
+        """
+        Capture a finger image on the sensor. With `wait_for_lift`, a finger
+        that is still resting on the sensor from the previous capture is
+        ignored until the sensor has reported no finger at least once.
+        """
+        started = time.perf_counter()
+        self.update_message.emit("Place your finger on the sensor")
+        self.update_status.emit("Capturing finger image")
 
-                self.update_message.emit("Finger image successfully captured")
-                self.update_status.emit("Finger image captured")
-                break
+        try:
+            if not capture_image(self.ser, wait_for_lift, stop=self.stopped):
+                return False
+            profiler.record("finger_wait", time.perf_counter() - started)
+            self.update_message.emit("Finger image successfully captured")
+            self.update_status.emit("Finger image captured")
+            return True
         except ValueError as e:
+            profiler.count("protocol_errors")
             self.update_message.emit(
                 f"Failed to capture finger image. Please try again. ({e})"
             )
             self.update_status.emit("Failed to capture finger image")
+            return False
+
+    def upload_fingerprint_image(self) -> bool:
+        image = self.download_image()
+        if image is None or not self.check_quality(image):
+            return False
+
+        self.current_fp = self.build_fingerprint(image)
+        self.update_fp_grid.emit(self.current_fp, 0)
+        self.update_status.emit("Image downloaded")
+        return True
 
-    def upload_fingerprint_image(self):
-        self.ser.write(Command.UpImage.value)
+    def download_image(self) -> Optional[NDArray]:
+        if self.compressed:
+            self.ser.write(bytes(Command.UpImageCompressed))
+        else:
+            self.ser.write(bytes(Command.UpImage))
         self.update_message.emit(
             "Downloading image from sensor. Please wait..."
         )
         self.update_status.emit("Downloading image")
         self.update_pbar_value.emit(0)
-        image_bytes = bytearray()
-
-        try:
-            while True:
-                state_bytes = self.ser.read(1)
-                if not state_bytes:
-                    continue
 
-                state = DeviceState(state_bytes[0])
-                if state != DeviceState.DataStart:
-                    if state != DeviceState.CommandSuccess:
-                        raise ValueError("Data transfer error")
+        self.abort_requested.clear()
+        self.preview.fill(0)
+        last_preview = 0.0
+        decode = profiler.total("decode")
+
+        def on_chunk(start: int, stop: int):
+            nonlocal last_preview
+            if self.stopped.is_set():
+                # Leave the transfer, the port is closed right after
+                raise ProtocolError("Capture stopped")
+            if self.abort_requested.is_set():
+                return  # The sketch still sends the rest, just ignore it
+
+            with decode:
+                unpack_nibbles_into(
+                    self.receiver.image_view[start:stop], self.preview, start
+                )
+            self.update_pbar_value.emit(stop)
+            now = time.monotonic()
+            if now - last_preview >= self.preview_interval:
+                last_preview = now
+                self.update_preview.emit(self.preview.copy())
 
-                    self.update_message.emit("Image downloaded successfully.")
-                    self.update_status.emit("Download complete.")
-                    break
-
-                length_bytes = self.ser.read(1)
-                length = int.from_bytes(length_bytes, byteorder="big")
-                while length > self.ser.in_waiting:
-                    pass
-
-                data_bytes = self.ser.read(length)
-                image_bytes.extend(data_bytes)
-                self.update_pbar_value.emit(len(image_bytes))
-
-                state_bytes = self.ser.read(1)
-                state = DeviceState(state_bytes[0])
-                if state != DeviceState.DataEnd:
-                    raise ValueError("Data transfer error")
-
-            if len(image_bytes) != self.n_image_bytes:
-                raise ValueError("Image size mismatch")
+        try:
+            with profiler.stage("upimage"):
+                self.receiver.receive(self.ser, on_chunk)
+            if self.abort_requested.is_set():
+                self.update_message.emit(
+                    "Capture aborted. Place your finger again."
+                )
+                self.update_status.emit("Download aborted")
+                return None
+
+            decode.record()
+            profiler.observe(
+                "upimage_bytes_per_second", self.receiver.throughput
+            )
 
-            image = decode_image(image_bytes, self.image_dimension)
-            self.current_fp = Fingerprint(image)
-            self.update_fp_grid.emit(self.current_fp, 0)
-            self.update_status.emit("Image downloaded")
+            # The preview buffer is reused by the next download
+            image = self.preview.copy()
+            self.update_preview.emit(image)
+            self.update_message.emit("Image downloaded successfully.")
+            self.update_status.emit(
+                "Download complete "
+                f"({self.receiver.throughput / 1024:.1f} KiB/s)."
+            )
+            return image
 
         except ValueError as e:
+            if self.stopped.is_set():
+                return None
+            profiler.count("protocol_errors")
             self.update_message.emit(
                 f"Failed to download image. Please try again. ({e})"
             )
             self.update_status.emit("Failed to download image")
+            return None
+
+    def check_quality(self, image: NDArray) -> bool:
+        """Reject a poor capture before it is enhanced and skeletonized"""
+        report = assess_quality(image)
+        profiler.record("quality", report.elapsed)
+        if report.ok:
+            return True
+
+        profiler.count("quality_rejects")
+        saved = ""
+        if self.pipeline_time is not None:
+            saved = (
+                f", saved ~{(self.pipeline_time - report.elapsed) * 1000:.0f}"
+                " ms of enhancement"
+            )
+        self.update_message.emit(
+            "Poor image quality. Please clean the sensor and place your "
+            f"finger again. ({', '.join(report.reasons)})"
+        )
+        self.update_status.emit(
+            f"Image rejected in {report.elapsed * 1000:.1f} ms{saved}"
+        )
+        return False
+
+    def build_fingerprint(self, image: NDArray) -> Fingerprint:
+        misses = template_cache.misses
+        start = time.perf_counter()
+        # A live probe is seen once, it is not worth keeping on disk
+        fp = template_cache.fingerprint(image, persist=False)
+        elapsed = time.perf_counter() - start
+        if template_cache.misses == misses:
+            self.update_status.emit("Template found in cache")
+        elif self.pipeline_time is None:
+            self.pipeline_time = elapsed
+        else:
+            self.pipeline_time = 0.8 * self.pipeline_time + 0.2 * elapsed
+        return fp
 
     def match_fingerprint(self):
-        best_n_matches = 12
-        best_match_fp = None
-
-        for fp_path in db_dir.glob("*/original.bmp"):
-            fp = Fingerprint(cv2.imread(str(fp_path), cv2.IMREAD_GRAYSCALE))
+        min_n_matches = 12
+        best_match_name = None
+
+        with profiler.stage("match"):
+            candidates = template_index.identify(self.current_fp.minutiae)
+        for name, n_matches in candidates:
+            print(f"{name}: {n_matches} matches")
+
+        if candidates and candidates[0][1] >= min_n_matches:
+            best_match_name = candidates[0][0]
+
+        if best_match_name is not None:
+            fp_path = capture_path(db_dir / best_match_name)
+            with profiler.stage("template_load"):
+                img = load_capture(fp_path)
+            fp = template_cache.fingerprint(img)
             self.update_fp_grid.emit(fp, 1)
-            n_matches = match_minutiae(fp.minutiae, self.current_fp.minutiae)
-            print(f"{fp_path.parent.name}: {n_matches} matches")
-
-            if n_matches >= best_n_matches:
-                best_match_fp = fp
-                best_n_matches = n_matches
-
-        if best_match_fp is not None:
             self.update_status.emit("Fingerprint matched")
-            self.update_message.emit(f"Hello, {fp_path.parent.name}!")
+            self.update_message.emit(f"Hello, {best_match_name}!")
         else:
             self.update_status.emit("Fingerprint not matched")
             self.update_message.emit(
@@ -220,13 +407,28 @@ class AS608Thread(QThread):
 
 
 class AS608Window(QMainWindow):
-    def __init__(self):
+    # Seconds between two refreshes of the profile in the status bar
+    profile_interval = 1.0
+
+    def __init__(
+        self,
+        baud_rate: int = BAUD_RATES[0],
+        kiosk: bool = False,
+        profile_path: Optional[Path] = None,
+        compressed: bool = False,
+    ):
         super().__init__()
         self.current_fp: Optional[Fingerprint] = None
+        self.baud_rate = baud_rate
+        self.kiosk = kiosk
+        self.profile_path = profile_path
+        self.compressed = compressed
 
         self.setWindowTitle("AS608 Fingerprint Sensor GUI")
 
-        self.as608_thread = AS608Thread()
+        self.as608_thread = AS608Thread(
+            baud_rate, kiosk, compressed=compressed
+        )
 
         self.init_ui()
         self.init_fingerprint_thread()
@@ -256,6 +458,12 @@ class AS608Window(QMainWindow):
         self.status_bar.setFont(QFont("System", 10))
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Status: Not connected")
+        if profiler.enabled:
+            self.profile_label = QLabel(self.status_bar)
+            self.status_bar.addPermanentWidget(self.profile_label)
+            self.profile_timer = QTimer(self)
+            self.profile_timer.timeout.connect(self.update_profile)
+            self.profile_timer.start(int(self.profile_interval * 1000))
 
         # Add widgets to the central layout
         self.central_layout.addLayout(self.fp_grid)
@@ -290,9 +498,16 @@ class AS608Window(QMainWindow):
         self.btn.clicked.connect(self.restart)
         self.input_layout.addWidget(self.btn)
 
+        self.abort_btn = QPushButton("Abort")
+        self.abort_btn.setFixedSize(100, 30)
+        self.abort_btn.setFont(QFont("System", 14))
+        self.abort_btn.clicked.connect(self.abort_download)
+        self.input_layout.addWidget(self.abort_btn)
+
     def init_fingerprint_thread(self):
         self.as608_thread.update_status.connect(self.update_status)
         self.as608_thread.update_fp_grid.connect(self.update_fp_grid)
+        self.as608_thread.update_preview.connect(self.update_preview)
         self.as608_thread.toggle_name_input.connect(self.toggle_name_input)
 
         self.as608_thread.update_message.connect(self.message_label.setText)
@@ -303,6 +518,12 @@ class AS608Window(QMainWindow):
     def update_status(self, status):
         self.status_bar.showMessage(f"Status: {status}")
 
+    def update_profile(self):
+        """Show rolling p50/p95 per stage, and export them if asked to"""
+        self.profile_label.setText(profiler.summary())
+        if self.profile_path is not None:
+            profiler.export(self.profile_path)
+
     def update_fp_grid(self, fp: Fingerprint, row: int):
         if row not in (0, 1):
             raise ValueError("row exceeds grid size")
@@ -318,6 +539,12 @@ class AS608Window(QMainWindow):
         ):
             self.fp_labels[row][i].setPixmap(to_pixmap(img))
 
+    def update_preview(self, image: NDArray[np.uint8]):
+        self.fp_labels[0][0].setPixmap(to_pixmap(image))
+
+    def abort_download(self):
+        self.as608_thread.abort_download()
+
     def toggle_name_input(self, show: bool):
         self.name_input.setVisible(show)
 
@@ -330,6 +557,7 @@ class AS608Window(QMainWindow):
             return
 
         self.current_fp.save(db_dir, name)
+        template_index.add(name)
         self.message_label.setText(
             f"Fingerprint successfully registered as \"{name}\"!"
         )
@@ -337,23 +565,61 @@ class AS608Window(QMainWindow):
 
     def restart(self):
         if self.as608_thread.isRunning():
-            self.as608_thread.terminate()
-            self.as608_thread.ser.close()
-            self.as608_thread = AS608Thread()
+            self.as608_thread.stop()
+            self.as608_thread = AS608Thread(
+                self.baud_rate, self.kiosk, compressed=self.compressed
+            )
             self.init_fingerprint_thread()
         self.name_input.hide()
         self.as608_thread.start()
 
     def closeEvent(self, a0):
-        self.as608_thread.terminate()
-        self.as608_thread.ser.close()
+        self.as608_thread.stop()
         print("serial port closed")
+        if profiler.enabled:
+            print(profiler.to_json())
+            if self.profile_path is not None:
+                profiler.export(self.profile_path)
         super().closeEvent(a0)
 
 
 def main():
+    parser = argparse.ArgumentParser(description="AS608 fingerprint GUI")
+    parser.add_argument(
+        "--baud",
+        type=int,
+        choices=BAUD_RATES,
+        default=BAUD_RATES[0],
+        help="host link rate to negotiate with the sketch",
+    )
+    parser.add_argument(
+        "--kiosk",
+        action="store_true",
+        help="identify fingers continuously, capturing while matching",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="time every pipeline stage and show p50/p95 in the status bar",
+    )
+    parser.add_argument(
+        "--profile-out",
+        type=Path,
+        help="keep the profile in this file, Prometheus text if it ends "
+        "with .prom, JSON otherwise (implies --profile)",
+    )
+    parser.add_argument(
+        "--compressed",
+        action="store_true",
+        help="transfer images delta-compressed (needs a matching sketch)",
+    )
+    args = parser.parse_args()
+    profiler.enabled = args.profile or args.profile_out is not None
+
     app = QApplication([])
-    window = AS608Window()
+    window = AS608Window(
+        args.baud, args.kiosk, args.profile_out, args.compressed
+    )
     window.show()
     app.exec()
 
@@ -0,0 +1,351 @@
+import threading
+import time
+from enum import Enum
+from typing import Callable, Optional
+
+import serial
+from serial.tools.list_ports import comports
+from serial.tools.list_ports_common import ListPortInfo
+
+from image_codec import MAX_DELTA_PAYLOAD, delta_decode
+
+# Host link rates understood by Command.SetBaudRate, see BaudRates in
+# src/Controller.h. The sketch always starts at the first one.
+BAUD_RATES = (57600, 115200, 250000, 500000, 1000000)
+# Must match BaudRateAckTimeout in src/Controller.h, in seconds
+BAUD_RATE_ACK_TIMEOUT = 1.0
+
+
+class DeviceState(Enum):
+    Initialization = 0x00
+    InitializationComplete = 0x01
+    InitializationFailed = 0x02
+    CommandSuccess = 0x03
+    CommandFailed = 0x04
+    CommandTimeout = 0x05
+    NoFingerDetected = 0x06
+    DataStart = 0x07
+    DataEnd = 0x08
+    CompressedData = 0x09
+    Idle = 0x69
+
+    def __str__(self):
+        return self.name
+
+
+class Command(Enum):
+    GetImage = 0x01
+    UpImage = 0x0A
+    WriteReg = 0x0E
+
+    Acknowledgement = 0x30
+    PrintDeviceParameters = 0x31
+    SetBaudRate = 0x32
+    UpImageCompressed = 0x33
+
+    def __str__(self):
+        return self.name
+
+    def __bytes__(self):
+        return bytes([self.value])
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+def wait_for_initialization(
+    ser: serial.Serial,
+    on_state: Optional[Callable[[DeviceState], None]] = None,
+    stop: Optional[threading.Event] = None,
+) -> bool:
+    """
+    Read the states the sketch sends once the port is opened until the
+    sensor is ready, passing each to `on_state`. Raises ProtocolError if
+    the sensor failed to initialize. Returns False if `stop` is set first.
+    """
+    while stop is None or not stop.is_set():
+        state_byte = ser.read(1)
+        if not state_byte:
+            continue  # No data received, keep waiting
+
+        state = DeviceState(state_byte[0])
+        if on_state is not None:
+            on_state(state)
+        if state == DeviceState.InitializationComplete:
+            return True
+        if state == DeviceState.InitializationFailed:
+            raise ProtocolError("Initialization failed.")
+    return False
+
+
+def capture_image(
+    ser: serial.Serial,
+    wait_for_lift: bool = False,
+    on_no_finger: Optional[Callable[[], None]] = None,
+    stop: Optional[threading.Event] = None,
+) -> bool:
+    """
+    Send GetImage until the sensor captures a finger, calling
+    `on_no_finger` each time it reports none. With `wait_for_lift`, a
+    finger still resting on the sensor from the previous capture is
+    ignored until the sensor has reported no finger at least once. Raises
+    ProtocolError if the command fails. Returns False, leaving the sketch
+    polling the sensor, if `stop` is set before a finger is captured.
+    """
+    ser.write(bytes(Command.GetImage))
+    finger_lifted = not wait_for_lift
+    while stop is None or not stop.is_set():
+        response = ser.read(1)
+        if not response:
+            continue
+
+        if response[0] == DeviceState.NoFingerDetected.value:
+            finger_lifted = True
+            if on_no_finger is not None:
+                on_no_finger()
+            continue
+
+        if response[0] != DeviceState.CommandSuccess.value:
+            raise ProtocolError(f"Command failed ({state_name(response[0])})")
+
+        if finger_lifted:
+            return True
+        ser.write(bytes(Command.GetImage))
+    return False
+
+
+def write_register(ser: serial.Serial, address: int, value: int) -> None:
+    """Set a sensor system register, raising ProtocolError on failure"""
+    ser.write(bytes([Command.WriteReg.value, address, value]))
+    while True:
+        response = ser.read(1)
+        if not response:
+            continue
+        if response[0] != DeviceState.CommandSuccess.value:
+            raise ProtocolError(f"Command failed ({state_name(response[0])})")
+        return
+
+
+def negotiate_baud_rate(ser: serial.Serial, baud_rate: int) -> int:
+    """
+    Move the host link to `baud_rate` (one of `BAUD_RATES`) and return the
+    rate in effect afterwards, which is the old one if the sketch refused
+    or the handshake failed:
+
+        host: SetBaudRate, index    -> sketch: CommandSuccess (old rate)
+        host: Acknowledgement       -> sketch: CommandSuccess (new rate)
+    """
+    if baud_rate == ser.baudrate:
+        return baud_rate
+    if baud_rate not in BAUD_RATES:
+        raise ValueError(f"Unsupported baud rate: {baud_rate}")
+
+    old_baud_rate = ser.baudrate
+    ser.reset_input_buffer()
+    ser.write(bytes([Command.SetBaudRate.value, BAUD_RATES.index(baud_rate)]))
+    response = ser.read(1)
+    if not response or response[0] != DeviceState.CommandSuccess.value:
+        return old_baud_rate
+
+    start = time.monotonic()
+    ser.baudrate = baud_rate
+    ser.reset_input_buffer()
+    ser.write(bytes([Command.Acknowledgement.value]))
+    response = ser.read(1)
+    if response and response[0] == DeviceState.CommandSuccess.value:
+        return baud_rate
+
+    # Let the sketch give up on the new rate before talking at the old one
+    time.sleep(max(0.0, start + BAUD_RATE_ACK_TIMEOUT - time.monotonic()))
+    ser.baudrate = old_baud_rate
+    ser.reset_input_buffer()
+    return old_baud_rate
+
+
+class UpImageReceiver:
+    """
+    Incremental parser for the UpImage byte stream sent by Control.ino:
+
+        (DataStart, length, payload[length], DataEnd)* CommandSuccess
+
+    or, in reply to UpImageCompressed, with frames of
+    (CompressedData, length, frame[length], DataEnd) that are decoded with
+    `delta_decode` as soon as they are complete.
+
+    Serial data is read in as large blocks as are available (or known to be
+    coming) into a reusable buffer, and the payloads are copied straight
+    into a preallocated image buffer. Reads block in the OS for the serial
+    timeout instead of polling `in_waiting`.
+    """
+
+    ExpectState = 0
+    ExpectLength = 1
+    ExpectPayload = 2
+    ExpectDataEnd = 3
+    Done = 4
+
+    def __init__(self, n_image_bytes: int, read_size: int = 4096):
+        self.image = bytearray(n_image_bytes)
+        self.image_view = memoryview(self.image)
+        self._read_buffer = memoryview(bytearray(read_size))
+        self._frame = bytearray(255)
+        self._frame_view = memoryview(self._frame)
+        self.reset()
+
+    def reset(self) -> None:
+        self.state = self.ExpectState
+        self.n_received = 0
+        self.n_wire_bytes = 0
+        self.elapsed = 0.0
+        self._frame_start = 0
+        self._remaining = 0
+        self._compressed = False
+        self._frame_size = 0
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second on the wire during the last transfer"""
+        return self.n_wire_bytes / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.state == self.Done
+
+    def _bytes_needed(self) -> int:
+        """Bytes that are certain to follow before the next decision"""
+        if self.state == self.ExpectPayload:
+            return self._remaining + 1
+        return 1
+
+    def receive(
+        self,
+        ser: serial.Serial,
+        on_chunk: Optional[Callable[[int, int], None]] = None,
+    ) -> memoryview:
+        """
+        Read a whole image from `ser`. `on_chunk(start, stop)` is called
+        with the byte range of the image filled in by each frame.
+        """
+        self.reset()
+        start = None
+        while not self.done:
+            size = min(
+                max(self._bytes_needed(), ser.in_waiting),
+                len(self._read_buffer),
+            )
+            n = ser.readinto(self._read_buffer[:size])
+            if not n:
+                if start is None:
+                    continue  # Still waiting for the sensor to start
+                raise ProtocolError("Data transfer timed out")
+            if start is None:
+                start = time.perf_counter()
+            self.n_wire_bytes += n
+            self.feed(self._read_buffer[:n], on_chunk)
+        self.elapsed = time.perf_counter() - start
+
+        if self.n_received != len(self.image):
+            raise ProtocolError(
+                f"Image size mismatch ({self.n_received} bytes)"
+            )
+        return self.image_view
+
+    def feed(
+        self,
+        data: memoryview | bytes,
+        on_chunk: Optional[Callable[[int, int], None]] = None,
+    ) -> int:
+        """
+        Advance the parser over `data` and return how many bytes it used,
+        which is less than len(data) only once the transfer is done.
+        """
+        i = 0
+        while i < len(data) and not self.done:
+            if self.state == self.ExpectPayload:
+                n = min(self._remaining, len(data) - i)
+                if self._compressed:
+                    start = self._frame_size - self._remaining
+                    self._frame_view[start : start + n] = data[i : i + n]
+                else:
+                    start = self.n_received
+                    self.image_view[start : start + n] = data[i : i + n]
+                    self.n_received += n
+                self._remaining -= n
+                i += n
+                if self._remaining == 0:
+                    self.state = self.ExpectDataEnd
+                continue
+
+            byte = data[i]
+            i += 1
+            if self.state == self.ExpectState:
+                if byte == DeviceState.CommandSuccess.value:
+                    self.state = self.Done
+                elif byte == DeviceState.DataStart.value:
+                    self._compressed = False
+                    self.state = self.ExpectLength
+                elif byte == DeviceState.CompressedData.value:
+                    self._compressed = True
+                    self.state = self.ExpectLength
+                else:
+                    raise ProtocolError(
+                        f"Data transfer error ({state_name(byte)})"
+                    )
+            elif self.state == self.ExpectLength:
+                if (
+                    not self._compressed
+                    and self.n_received + byte > len(self.image)
+                ):
+                    raise ProtocolError("Image size mismatch")
+                self._frame_start = self.n_received
+                self._frame_size = byte
+                self._remaining = byte
+                self.state = (
+                    self.ExpectPayload if byte else self.ExpectDataEnd
+                )
+            elif self.state == self.ExpectDataEnd:
+                if byte != DeviceState.DataEnd.value:
+                    raise ProtocolError(
+                        f"Data transfer error ({state_name(byte)})"
+                    )
+                if self._compressed:
+                    self._decode_frame()
+                self.state = self.ExpectState
+                if on_chunk is not None:
+                    on_chunk(self._frame_start, self.n_received)
+
+        return i
+
+    def _decode_frame(self) -> None:
+        frame = self._frame_view[: self._frame_size]
+        n = frame[0] if self._frame_size else 0
+        if n > MAX_DELTA_PAYLOAD or self.n_received + n > len(self.image):
+            raise ProtocolError("Image size mismatch")
+        try:
+            delta_decode(
+                frame, self.image_view[self.n_received : self.n_received + n]
+            )
+        except ValueError as e:
+            raise ProtocolError(f"Corrupt compressed frame ({e})") from e
+        self.n_received += n
+
+
+def state_name(byte: int) -> str:
+    try:
+        return str(DeviceState(byte))
+    except ValueError:
+        return f"0x{byte:02X}"
+
+
+def find_arduino_ports() -> list[ListPortInfo]:
+    return [
+        port for port in sorted(comports()) if "Arduino" in port.description
+    ]
+
+
+def find_arduino_port() -> ListPortInfo:
+    arduino_ports = find_arduino_ports()
+    if not arduino_ports:
+        raise ValueError("Arduino not found")
+    return arduino_ports[0]
@@ -0,0 +1,57 @@
+import sys
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from image_codec import unpack_nibbles  # noqa: E402
+
+DIMENSION = (256, 288)
+
+
+def decode_image_loop(image_bytes: bytes, dimension: tuple[int, int]):
+    """The original per-byte decoder, kept as the baseline"""
+    pixels = bytearray()
+    for byte in image_bytes:
+        pixels.append(((byte >> 4) & 0x0F) * 17)
+        pixels.append((byte & 0x0F) * 17)
+    return np.reshape(
+        np.array(pixels, dtype=np.uint8), (dimension[1], dimension[0])
+    )
+
+
+def main():
+    rng = np.random.default_rng(0)
+    image_bytes = rng.integers(
+        0, 256, DIMENSION[0] * DIMENSION[1] // 2, dtype=np.uint8
+    ).tobytes()
+    out = np.empty((DIMENSION[1], DIMENSION[0]), dtype=np.uint8)
+
+    assert np.array_equal(
+        decode_image_loop(image_bytes, DIMENSION),
+        unpack_nibbles(image_bytes, DIMENSION),
+    )
+
+    cases = {
+        "loop": lambda: decode_image_loop(image_bytes, DIMENSION),
+        "lut": lambda: unpack_nibbles(image_bytes, DIMENSION),
+        "lut (preallocated)": lambda: unpack_nibbles(
+            image_bytes, DIMENSION, out=out
+        ),
+    }
+
+    baseline = None
+    for name, func in cases.items():
+        n, _ = timeit.Timer(func).autorange()
+        best = min(timeit.repeat(func, number=n, repeat=5)) / n
+        baseline = baseline or best
+        print(
+            f"{name:>20}: {best * 1e6:10.1f} us/image "
+            f"({baseline / best:6.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fingerprint_enhancer import enhance_Fingerprint  # noqa: E402
+from fingerprint_matcher import TileEnhancer  # noqa: E402
+
+db_dir = Path(__file__).resolve().parents[1] / "db"
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the tiled enhancer against enhance_Fingerprint"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 2, 4, 8]
+    )
+    args = parser.parse_args()
+
+    captures = {
+        str(path.relative_to(db_dir)): cv2.imread(
+            str(path), cv2.IMREAD_GRAYSCALE
+        )
+        for path in [*db_dir.glob("*.bmp"), *db_dir.glob("*/original.bmp")]
+    }
+
+    print(f"{os.cpu_count()} CPUs")
+    header = "".join(f"{f'{n} workers':>18}" for n in args.workers)
+    print(f"{'capture':>30} {'stock':>8}{header}")
+    for name, img in captures.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = enhance_Fingerprint(img)
+            stock = best_time(lambda: enhance_Fingerprint(img), args.repeat)
+            row = ""
+            for workers in args.workers:
+                actual = TileEnhancer(workers).enhance(img, resize=False)
+                assert np.array_equal(actual, expected), (name, workers)
+                tiled = best_time(
+                    lambda: TileEnhancer(workers).enhance(img, resize=False),
+                    args.repeat,
+                )
+                row += f" {tiled * 1e3:7.0f}ms {stock / tiled:6.2f}x"
+        print(f"{name:>30} {stock * 1e3:6.0f}ms{row}")
+
+
+if __name__ == "__main__":
+    main()
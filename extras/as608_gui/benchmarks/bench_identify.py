@@ -0,0 +1,52 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_match import jitter, random_minutiae  # noqa: E402
+from fingerprint_matcher import match_minutiae_vectorized  # noqa: E402
+from gallery import Gallery  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="1:N identification")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--minutiae", type=int, default=60)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'users':>6} {'loop':>10} {'gallery':>10} {'speedup':>8}")
+    for n_users in (10, 100, 1000, 10000):
+        templates = [
+            (f"user{i}", random_minutiae(rng, rng.integers(20, args.minutiae)))
+            for i in range(n_users)
+        ]
+        probe = jitter(rng, templates[n_users // 2][1])
+        gallery = Gallery.from_templates(templates)
+
+        start = time.perf_counter()
+        expected = [
+            match_minutiae_vectorized(minutiae, probe)
+            for _, minutiae in templates
+        ]
+        loop = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scores = gallery.score(probe, chunk_size=args.chunk_size)
+        top = gallery.identify(probe, top_k=1, chunk_size=args.chunk_size)
+        batched = (time.perf_counter() - start) / 2
+
+        assert scores.tolist() == expected
+        assert top[0][0] == f"user{n_users // 2}"
+        print(
+            f"{n_users:6d} {loop * 1e3:8.1f}ms {batched * 1e3:8.1f}ms "
+            f"{loop / batched:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
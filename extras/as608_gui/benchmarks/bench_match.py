@@ -0,0 +1,104 @@
+import sys
+import timeit
+import warnings
+from itertools import product
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fingerprint_matcher import (  # noqa: E402
+    MINUTIA_TYPES,
+    Fingerprint,
+    Minutia,
+    match_minutiae,
+    match_minutiae_vectorized,
+)
+
+db_dir = Path(__file__).resolve().parents[1] / "db"
+
+
+def random_minutiae(rng: np.random.Generator, n: int) -> list[Minutia]:
+    return [
+        Minutia(
+            int(rng.integers(0, 288)),
+            int(rng.integers(0, 256)),
+            float(rng.uniform(-180, 180)),
+            MINUTIA_TYPES[rng.integers(0, 2)],
+        )
+        for _ in range(n)
+    ]
+
+
+def jitter(rng: np.random.Generator, minutiae: list[Minutia]) -> list[Minutia]:
+    return [
+        Minutia(
+            m.x + int(rng.integers(-10, 11)),
+            m.y + int(rng.integers(-10, 11)),
+            m.angle + float(rng.uniform(-40, 40)),
+            m.type,
+        )
+        for m in minutiae
+    ]
+
+
+def best_time(func) -> float:
+    n, _ = timeit.Timer(func).autorange()
+    return min(timeit.repeat(func, number=n, repeat=3)) / n
+
+
+def check_db_samples():
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fps = {
+            str(path.relative_to(db_dir)): Fingerprint(
+                cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+            )
+            for path in [*db_dir.glob("*.bmp"), *db_dir.glob("*/original.bmp")]
+        }
+
+    for (name1, fp1), (name2, fp2) in product(fps.items(), repeat=2):
+        expected = match_minutiae(fp1.minutiae, fp2.minutiae)
+        actual = match_minutiae_vectorized(fp1.minutiae, fp2.minutiae)
+        hungarian = match_minutiae_vectorized(
+            fp1.minutiae, fp2.minutiae, assignment="hungarian"
+        )
+        assert expected == actual, (name1, name2, expected, actual)
+        print(
+            f"{name1:>30} vs {name2:<30} "
+            f"greedy={actual:3d} hungarian={hungarian:3d}"
+        )
+
+
+def main():
+    check_db_samples()
+
+    rng = np.random.default_rng(0)
+    print(f"{'n':>6} {'loop':>10} {'vectorized':>10} {'kd-tree':>10}")
+    for n in (25, 50, 100, 200, 400, 800, 1600, 3200):
+        m1 = random_minutiae(rng, n)
+        m2 = jitter(rng, m1)
+        expected = match_minutiae_vectorized(m1, m2)
+        assert expected == match_minutiae_vectorized(
+            m1, m2, spatial_index=True
+        )
+
+        # The pure Python loop gets too slow to time beyond a few hundred
+        if n <= 400:
+            assert match_minutiae(m1, m2) == expected
+            loop = f"{best_time(lambda: match_minutiae(m1, m2)) * 1e3:.2f}ms"
+        else:
+            loop = "-"
+        vectorized = best_time(lambda: match_minutiae_vectorized(m1, m2))
+        kdtree = best_time(
+            lambda: match_minutiae_vectorized(m1, m2, spatial_index=True)
+        )
+        print(
+            f"{n:6d} {loop:>10} {vectorized * 1e3:8.2f}ms "
+            f"{kdtree * 1e3:8.2f}ms"
+        )
+
+if __name__ == "__main__":
+    main()
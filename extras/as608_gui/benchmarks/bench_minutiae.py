@@ -0,0 +1,75 @@
+import argparse
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_roi import partial_captures  # noqa: E402
+from fingerprint_matcher import (  # noqa: E402
+    MINUTIAE_BACKENDS,
+    Fingerprint,
+    skeleton_minutiae,
+)
+
+db_dir = Path(__file__).resolve().parents[1] / "db"
+
+
+def best_time(func, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Time the minutiae backends on the pipeline's skeletons"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    captures = {
+        str(path.relative_to(db_dir)): cv2.imread(
+            str(path), cv2.IMREAD_GRAYSCALE
+        )
+        for path in [*db_dir.glob("*.bmp"), *db_dir.glob("*/original.bmp")]
+    }
+    rng = np.random.default_rng(0)
+    samples = list(captures.values())
+    for i, capture in enumerate(partial_captures(rng, samples[0], 5)):
+        captures[f"partial {i}"] = capture
+
+    header = "".join(f"{backend:>12}" for backend in MINUTIAE_BACKENDS)
+    print(f"{'capture':>30} {'minutiae':>8}{header} {'speedup':>8}")
+    for name, img in captures.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            skeleton = Fingerprint(img).aligned_img
+            results = {
+                backend: skeleton_minutiae(skeleton, backend).data.tolist()
+                for backend in MINUTIAE_BACKENDS
+            }
+            times = {
+                backend: best_time(
+                    lambda: skeleton_minutiae(skeleton, backend), args.repeat
+                )
+                for backend in MINUTIAE_BACKENDS
+            }
+        assert results["vectorized"] == results["reference"], name
+
+        row = "".join(f"{t * 1e3:10.1f}ms" for t in times.values())
+        speedup = times["reference"] / times["vectorized"]
+        print(
+            f"{name:>30} {len(results['reference']):>8}{row} {speedup:7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
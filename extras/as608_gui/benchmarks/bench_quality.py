@@ -0,0 +1,108 @@
+import sys
+import time
+import timeit
+import warnings
+from pathlib import Path
+
+import cv2
+import numpy as np
+from skimage.morphology import skeletonize
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fingerprint_enhancer import enhance_Fingerprint  # noqa: E402
+from fingerprint_feature_extractor import (  # noqa: E402
+    extract_minutiae_features,
+)
+from fingerprint_matcher import align_image  # noqa: E402
+from image_quality import (  # noqa: E402
+    MIN_COHERENCE,
+    MIN_CONTRAST,
+    MIN_COVERAGE,
+    assess_quality,
+)
+
+db_dir = Path(__file__).resolve().parents[1] / "db"
+
+
+def quantize(img: np.ndarray) -> np.ndarray:
+    """Round to the 16 gray levels the sensor sends"""
+    return (np.round(np.clip(img, 0, 255) / 17) * 17).astype(np.uint8)
+
+
+def degraded_captures(good: np.ndarray) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    background = int(np.max(good))
+    partial = good.copy()
+    partial[:, : good.shape[1] * 5 // 8] = background
+    return {
+        "empty": np.full_like(good, background),
+        "noise": quantize(rng.integers(68, 205, good.shape)),
+        "partial": partial,
+        "faint": quantize(background - (background - good) * 0.3),
+        "smudged": quantize(cv2.GaussianBlur(good, (0, 0), 4)),
+    }
+
+
+def pipeline_stages(img: np.ndarray) -> dict[str, float]:
+    """
+    Wall time of each stage `Fingerprint` runs, in seconds. Stages after
+    one that raises are missing.
+    """
+    stages = {
+        "enhance": enhance_Fingerprint,
+        "skeletonize": lambda img: align_image(
+            np.uint8(skeletonize(img)) * 255
+        ),
+        "extract": extract_minutiae_features,
+    }
+    times = {}
+    for name, stage in stages.items():
+        start = time.perf_counter()
+        try:
+            img = stage(img)
+        except Exception:
+            times[name] = time.perf_counter() - start
+            break
+        times[name] = time.perf_counter() - start
+    return times
+
+
+def main():
+    print(
+        f"thresholds: coverage >= {MIN_COVERAGE}, contrast >= "
+        f"{MIN_CONTRAST}, coherence >= {MIN_COHERENCE}"
+    )
+
+    captures = {
+        str(path.relative_to(db_dir)): cv2.imread(
+            str(path), cv2.IMREAD_GRAYSCALE
+        )
+        for path in [*db_dir.glob("*.bmp"), *db_dir.glob("*/original.bmp")]
+    }
+    captures.update(degraded_captures(captures["demo.bmp"]))
+
+    print(
+        f"{'capture':>30} {'coverage':>8} {'contrast':>8} {'coherence':>9} "
+        f"{'gate':>7} {'enhance':>8} {'skeleton':>8} {'extract':>8}"
+    )
+    for name, img in captures.items():
+        report = assess_quality(img)
+        gate = min(timeit.repeat(lambda: assess_quality(img), number=20)) / 20
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            stages = pipeline_stages(img)
+        row = [
+            f"{name:>30} {report.coverage:8.2f} {report.contrast:8.1f}",
+            f"{report.coherence:9.2f} {gate * 1e3:5.1f}ms",
+            *(f"{t * 1e3:6.0f}ms" for t in stages.values()),
+            *(f"{'failed':>8}" for _ in range(3 - len(stages))),
+        ]
+        if not report.ok:
+            saved = sum(stages.values()) - gate
+            row.append(f" rejected, saves {saved * 1e3:.0f}ms")
+        print(" ".join(row))
+
+
+if __name__ == "__main__":
+    main()
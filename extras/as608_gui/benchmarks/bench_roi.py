@@ -0,0 +1,101 @@
+import sys
+import time
+import warnings
+from pathlib import Path
+
+import cv2
+import numpy as np
+from skimage.morphology import skeletonize
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from fingerprint_enhancer import enhance_Fingerprint  # noqa: E402
+from fingerprint_feature_extractor import (  # noqa: E402
+    extract_minutiae_features,
+)
+from fingerprint_matcher import (  # noqa: E402
+    MINUTIA_DTYPE,
+    Fingerprint,
+    align_image,
+    foreground_roi,
+)
+
+db_dir = Path(__file__).resolve().parents[1] / "db"
+
+
+def full_frame_minutiae(img: np.ndarray) -> list[tuple]:
+    """The pipeline before cropping, kept as the baseline"""
+    skeleton = np.uint8(skeletonize(enhance_Fingerprint(img))) * 255
+    terminations, bifurcations = extract_minutiae_features(
+        align_image(skeleton)
+    )
+    minutiae = np.array(
+        [
+            (m.locX, m.locY, m.Orientation[0], type)
+            for type, features in enumerate((terminations, bifurcations))
+            for m in features
+        ],
+        dtype=MINUTIA_DTYPE,
+    )
+    return sorted(minutiae.tolist())
+
+
+def roi_minutiae(img: np.ndarray) -> list[tuple]:
+    return sorted(Fingerprint(img, features_only=True).minutiae.data.tolist())
+
+
+def partial_captures(
+    rng: np.random.Generator, img: np.ndarray, n: int
+) -> list[np.ndarray]:
+    """Keep a random window of the finger, as when it is placed off center"""
+    background = int(np.max(img))
+    captures = []
+    for _ in range(n):
+        top, left = rng.integers(0, 120, 2)
+        bottom, right = rng.integers(180, 289), rng.integers(150, 257)
+        capture = np.full_like(img, background)
+        capture[top:bottom, left:right] = img[top:bottom, left:right]
+        captures.append(capture)
+    return captures
+
+
+def timed(func, img: np.ndarray) -> tuple[list[tuple], float]:
+    start = time.perf_counter()
+    result = func(img)
+    return result, time.perf_counter() - start
+
+
+def main():
+    rng = np.random.default_rng(0)
+    captures = {
+        str(path.relative_to(db_dir)): cv2.imread(
+            str(path), cv2.IMREAD_GRAYSCALE
+        )
+        for path in [*db_dir.glob("*.bmp"), *db_dir.glob("*/original.bmp")]
+    }
+    samples = list(captures.values())
+    for i, capture in enumerate(partial_captures(rng, samples[0], 10)):
+        captures[f"partial {i}"] = capture
+
+    print(f"{'capture':>30} {'roi':>16} {'full':>8} {'roi':>8} {'speedup':>8}")
+    total_full = total_roi = 0.0
+    for name, img in captures.items():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected, full = timed(full_frame_minutiae, img)
+            actual, roi = timed(roi_minutiae, img)
+        assert actual == expected, name
+
+        rows, cols = foreground_roi(img)
+        total_full += full
+        total_roi += roi
+        print(
+            f"{name:>30} "
+            f"{rows.stop - rows.start:>7}x{cols.stop - cols.start:<8} "
+            f"{full * 1e3:6.0f}ms {roi * 1e3:6.0f}ms {full / roi:7.2f}x"
+        )
+    print(f"{'total':>30} {'':>16} {total_full:7.2f}s {total_roi:7.2f}s")
+
+
+if __name__ == "__main__":
+    main()
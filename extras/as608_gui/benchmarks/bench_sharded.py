@@ -0,0 +1,176 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from bench_match import jitter, random_minutiae  # noqa: E402
+from fingerprint_matcher import MinutiaSet  # noqa: E402
+from gallery import Gallery  # noqa: E402
+from mapped_gallery import (  # noqa: E402
+    MappedGallery,
+    ShardedGallery,
+    worker_context,
+    write_gallery,
+)
+
+# The whole gallery unpacked in each worker, what a pool without the
+# memory-mapped file has to hold
+_copy: Optional[Gallery] = None
+
+
+def load_copy(path: Path) -> None:
+    global _copy
+    gallery = MappedGallery(path)
+    _copy = gallery.gallery(0, len(gallery))
+
+
+def score_copy(probe, start: int, stop: int, top_k: int):
+    shard = Gallery(
+        _copy.names,
+        *(
+            array[start:stop]
+            for array in (
+                _copy.owner,
+                _copy.counts,
+                _copy.x,
+                _copy.y,
+                _copy.angle,
+                _copy.type,
+            )
+        ),
+    )
+    scores = shard.score(MinutiaSet(probe))
+    best = np.argsort(-scores, kind="stable")[:top_k]
+    return [(int(start + t), int(scores[t])) for t in best]
+
+
+def workers_memory() -> tuple[int, int]:
+    """
+    Total resident and private (anonymous) KiB of the pool workers: the
+    descendants of this process without children of their own, which
+    leaves out the fork server
+    """
+    children: dict[int, list[int]] = {}
+    for stat_path in Path("/proc").glob("[0-9]*/stat"):
+        try:
+            fields = stat_path.read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(
+            int(stat_path.parent.name)
+        )
+
+    rss = anon = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        if pid in children:
+            pending += children[pid]
+            continue
+        try:
+            status = Path(f"/proc/{pid}/status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            key, _, value = line.partition(":")
+            if key == "VmRSS":
+                rss += int(value.split()[0])
+            elif key == "RssAnon":
+                anon += int(value.split()[0])
+    return rss, anon
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sharded identification over a memory-mapped gallery"
+    )
+    parser.add_argument("--users", type=int, default=30000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    templates = [
+        (f"user{i}", random_minutiae(rng, int(rng.integers(20, 60))))
+        for i in range(args.users)
+    ]
+    target = args.users // 2
+    probe = MinutiaSet.from_minutiae(jitter(rng, templates[target][1]))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "gallery.bin"
+        start = time.perf_counter()
+        write_gallery(path, templates)
+        del templates
+        print(
+            f"{args.users} templates, {path.stat().st_size / 2**20:.1f} MiB "
+            f"written in {time.perf_counter() - start:.2f}s"
+        )
+        print(
+            f"{'variant':>8} {'workers':>7} {'startup':>9} {'query':>9} "
+            f"{'RSS':>9} {'private':>9}"
+        )
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            with ShardedGallery(path, workers) as sharded:
+                assert sharded.identify(probe, 1)[0][0] == f"user{target}"
+                startup = time.perf_counter() - start
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    sharded.identify(probe, 1)
+                    times.append(time.perf_counter() - start)
+                rss, anon = workers_memory()
+            print(
+                f"{'mapped':>8} {workers:7d} {startup:8.2f}s "
+                f"{statistics.median(times) * 1e3:7.1f}ms "
+                f"{rss / 1024:7.1f}MB {anon / 1024:7.1f}MB"
+            )
+
+            mapped = MappedGallery(path)
+            start = time.perf_counter()
+            with ProcessPoolExecutor(
+                workers,
+                mp_context=worker_context(),
+                initializer=load_copy,
+                initargs=(path,),
+            ) as executor:
+                shards = mapped.shards(workers)
+
+                def identify():
+                    futures = [
+                        executor.submit(score_copy, probe.data, a, b, 1)
+                        for a, b in shards
+                    ]
+                    return max(
+                        (c for f in futures for c in f.result()),
+                        key=lambda c: c[1],
+                    )
+
+                assert identify()[0] == target
+                startup = time.perf_counter() - start
+                times = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    identify()
+                    times.append(time.perf_counter() - start)
+                rss, anon = workers_memory()
+            print(
+                f"{'copied':>8} {workers:7d} {startup:8.2f}s "
+                f"{statistics.median(times) * 1e3:7.1f}ms "
+                f"{rss / 1024:7.1f}MB {anon / 1024:7.1f}MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
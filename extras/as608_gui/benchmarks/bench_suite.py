@@ -0,0 +1,401 @@
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout, suppress
+from datetime import datetime, timezone
+from io import StringIO
+from itertools import product
+from pathlib import Path
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from as608_controller import AS608Controller  # noqa: E402
+from as608_protocol import Command  # noqa: E402
+from bench_match import jitter, random_minutiae  # noqa: E402
+from fake_sensor import FakeAS608  # noqa: E402
+from fingerprint_matcher import (  # noqa: E402
+    Fingerprint,
+    match_minutiae,
+    match_minutiae_vectorized,
+)
+from gallery import Gallery  # noqa: E402
+from image_codec import pack_nibbles  # noqa: E402
+from profiling import profiler  # noqa: E402
+from utils import decode_image  # noqa: E402
+
+db_dir = Path(__file__).resolve().parents[1] / "db"
+DIMENSION = (256, 288)
+BENCHMARKS = (
+    "decode",
+    "controller",
+    "gui",
+    "reconnect",
+    "pipeline",
+    "match",
+    "identify",
+)
+
+
+def timings(func: Callable[[], object], repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class Results:
+    """Every measurement of a run, with enough context to compare runs"""
+
+    def __init__(self):
+        self.records: list[dict] = []
+
+    def add(
+        self, benchmark: str, params: dict, times: list[float], **metrics
+    ) -> None:
+        record = {
+            "benchmark": benchmark,
+            "params": params,
+            "unit": "s",
+            "n": len(times),
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.fmean(times),
+            "max": max(times),
+            **metrics,
+        }
+        self.records.append(record)
+        params_str = " ".join(f"{k}={v}" for k, v in params.items())
+        extra = " ".join(f"{k}={v:.4g}" for k, v in metrics.items())
+        print(
+            f"{benchmark:>10} {params_str:<72} "
+            f"{record['median'] * 1e3:10.3f}ms {extra}"
+        )
+
+    def to_json(self) -> str:
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                capture_output=True,
+                text=True,
+                cwd=Path(__file__).parent,
+            ).stdout.strip()
+        except OSError:
+            commit = ""
+        return json.dumps(
+            {
+                "meta": {
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "commit": commit,
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "platform": platform.platform(),
+                    "processor": platform.processor(),
+                },
+                "results": self.records,
+            },
+            indent=2,
+        )
+
+
+def bench_decode(results: Results, image_bytes: bytes, repeat: int) -> None:
+    times = timings(lambda: decode_image(image_bytes, DIMENSION), repeat * 100)
+    results.add("decode", {}, times)
+
+
+def bench_controller(
+    results: Results,
+    image_bytes: bytes,
+    chunk_size: int,
+    line_rate: Optional[int],
+    compressed: bool,
+    repeat: int,
+) -> None:
+    command = Command.UpImageCompressed if compressed else Command.UpImage
+
+    def upload():
+        controller.ser.write(bytes(command))
+        image = controller.upload_fingerprint_image(show=False)
+        assert pack_nibbles(np.asarray(image)) == image_bytes
+
+    # The controller reports progress on the console, keep it quiet
+    with (
+        FakeAS608(image_bytes, chunk_size, line_rate) as fake,
+        redirect_stdout(StringIO()),
+        redirect_stderr(StringIO()),
+        AS608Controller(
+            fake.port_name, baud_rate=line_rate or 57600
+        ) as controller,
+    ):
+        times = timings(upload, repeat)
+        throughput = controller.receiver.throughput
+        wire_bytes = controller.receiver.n_wire_bytes
+
+    results.add(
+        "controller",
+        {
+            "chunk_size": chunk_size,
+            "line_rate": line_rate or "unpaced",
+            "compressed": compressed,
+        },
+        times,
+        bytes_per_second=throughput,
+        wire_bytes=wire_bytes,
+    )
+
+
+def bench_gui(
+    results: Results,
+    image_bytes: bytes,
+    chunk_size: int,
+    line_rate: Optional[int],
+    compressed: bool,
+    repeat: int,
+) -> None:
+    # Imported here, the other benchmarks do not need Qt
+    from as608_gui import AS608Thread
+
+    def capture():
+        assert thread.get_fingerprint_image()
+        assert thread.upload_fingerprint_image()
+
+    with (
+        FakeAS608(image_bytes, chunk_size, line_rate) as fake,
+        redirect_stdout(StringIO()),
+    ):
+        thread = AS608Thread(
+            line_rate or 57600,
+            port_name=fake.port_name,
+            compressed=compressed,
+        )
+        thread.init_as608()
+        times = timings(capture, repeat)
+        thread.ser.close()
+
+    results.add(
+        "gui",
+        {
+            "chunk_size": chunk_size,
+            "line_rate": line_rate or "unpaced",
+            "compressed": compressed,
+        },
+        times,
+        n_minutiae=len(thread.current_fp.minutiae),
+        wire_bytes=thread.receiver.n_wire_bytes,
+    )
+
+
+def bench_reconnect(
+    results: Results, image_bytes: bytes, repeat: int
+) -> None:
+    """
+    Unplug a gateway reader while its session waits for a finger, and time
+    how long the session takes to capture again once it is plugged back
+    """
+    # Imported here, the other benchmarks do not need the gateway
+    from gateway import Gateway
+
+    async def reconnect(fake: FakeAS608, gateway: Gateway) -> list[float]:
+        queue: asyncio.Queue[bytes] = asyncio.Queue(1)
+        session = asyncio.create_task(gateway._capture(fake.port_name, queue))
+        try:
+            assert await asyncio.wait_for(queue.get(), 10) == image_bytes
+            times = []
+            for _ in range(repeat):
+                fake.finger.clear()
+                await asyncio.sleep(0.2)
+                fake.unplug()
+                await asyncio.sleep(0.2)
+                start = time.perf_counter()
+                fake.replug()
+                fake.finger.set()
+                assert await asyncio.wait_for(queue.get(), 10) == image_bytes
+                times.append(time.perf_counter() - start)
+            return times
+        finally:
+            session.cancel()
+            with suppress(asyncio.CancelledError):
+                await session
+
+    with (
+        FakeAS608(image_bytes) as fake,
+        ThreadPoolExecutor(1) as executor,
+        redirect_stdout(StringIO()),
+    ):
+        gateway = Gateway(db_dir, executor)
+        try:
+            times = asyncio.run(reconnect(fake, gateway))
+        finally:
+            gateway.close()
+
+    results.add("reconnect", {}, times)
+
+
+def bench_pipeline(
+    results: Results, images: dict[str, np.ndarray], repeat: int
+) -> None:
+    enabled = profiler.enabled
+    profiler.enabled = True
+    for name, img in images.items():
+        profiler.reset()
+        times = timings(lambda: Fingerprint(img, features_only=True), repeat)
+        stages = profiler.snapshot()["stages"]
+        results.add(
+            "pipeline",
+            {"image": name},
+            times,
+            **{f"{stage}_p50": stats["p50"] for stage, stats in stages.items()},
+        )
+    profiler.enabled = enabled
+
+
+def bench_match(
+    results: Results, images: dict[str, np.ndarray], repeat: int
+) -> None:
+    fps = {
+        name: Fingerprint(img, features_only=True)
+        for name, img in images.items()
+    }
+    for (name1, fp1), (name2, fp2) in product(fps.items(), repeat=2):
+        m1, m2 = fp1.minutiae, fp2.minutiae
+        for variant, func in (
+            ("loop", match_minutiae),
+            ("vectorized", match_minutiae_vectorized),
+        ):
+            times = timings(lambda: func(m1, m2), repeat * 10)
+            results.add(
+                "match",
+                {"probe": name1, "template": name2, "variant": variant},
+                times,
+                n_matches=func(m1, m2),
+            )
+
+
+def bench_identify(
+    results: Results, gallery_sizes: list[int], repeat: int
+) -> None:
+    rng = np.random.default_rng(0)
+    for n_users in gallery_sizes:
+        templates = [
+            (f"user{i}", random_minutiae(rng, int(rng.integers(20, 60))))
+            for i in range(n_users)
+        ]
+        probe = jitter(rng, templates[n_users // 2][1])
+
+        start = time.perf_counter()
+        gallery = Gallery.from_templates(templates)
+        build = time.perf_counter() - start
+
+        times = timings(lambda: gallery.identify(probe, top_k=1), repeat)
+        assert gallery.identify(probe, top_k=1)[0][0] == f"user{n_users // 2}"
+        results.add(
+            "identify",
+            {"users": n_users, "variant": "gallery"},
+            times,
+            build_seconds=build,
+        )
+
+        if n_users <= 1000:
+            times = timings(
+                lambda: max(
+                    match_minutiae(minutiae, probe)
+                    for _, minutiae in templates
+                ),
+                1,
+            )
+            results.add(
+                "identify", {"users": n_users, "variant": "loop"}, times
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the host pipeline against a simulated sensor"
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="write the results as JSON"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", nargs="+", choices=BENCHMARKS, default=list(BENCHMARKS)
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=128,
+        help="UpImage payload bytes per frame, as the sensor's packet length",
+    )
+    parser.add_argument(
+        "--line-rate",
+        type=int,
+        nargs="+",
+        default=[0, 1000000],
+        help="simulated baud rates, 0 for an unpaced link",
+    )
+    parser.add_argument(
+        "--gallery-sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000, 10000],
+    )
+    args = parser.parse_args()
+
+    images = {
+        str(path.relative_to(db_dir)): cv2.imread(
+            str(path), cv2.IMREAD_GRAYSCALE
+        )
+        for path in [*db_dir.glob("*.bmp"), *db_dir.glob("*/original.bmp")]
+    }
+    image_bytes = pack_nibbles(next(iter(images.values())))
+
+    results = Results()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if "decode" in args.only:
+            bench_decode(results, image_bytes, args.repeat)
+        for line_rate, compressed in product(args.line_rate, (False, True)):
+            if "controller" in args.only:
+                bench_controller(
+                    results,
+                    image_bytes,
+                    args.chunk_size,
+                    line_rate or None,
+                    compressed,
+                    args.repeat,
+                )
+            if "gui" in args.only:
+                bench_gui(
+                    results,
+                    image_bytes,
+                    args.chunk_size,
+                    line_rate or None,
+                    compressed,
+                    args.repeat,
+                )
+        if "reconnect" in args.only:
+            bench_reconnect(results, image_bytes, args.repeat)
+        if "pipeline" in args.only:
+            bench_pipeline(results, images, args.repeat)
+        if "match" in args.only:
+            bench_match(results, images, args.repeat)
+        if "identify" in args.only:
+            bench_identify(results, args.gallery_sizes, args.repeat)
+
+    if args.output is not None:
+        args.output.write_text(results.to_json())
+
+
+if __name__ == "__main__":
+    main()
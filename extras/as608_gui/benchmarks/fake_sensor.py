@@ -0,0 +1,240 @@
+import errno
+import os
+import select
+import sys
+import tempfile
+import threading
+import time
+import tty
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from as608_protocol import BAUD_RATES, Command, DeviceState  # noqa: E402
+from image_codec import delta_encode  # noqa: E402
+
+
+class FakeAS608:
+    """
+    Software stand-in for examples/Control/Control.ino on a pseudo terminal
+    (POSIX only), for measuring the host side without hardware.
+
+    `port_name` can be opened like the Arduino's port. The initialization
+    states are sent once something opens it. UpImage replies with
+    `image_bytes` in frames of `chunk_size` payload bytes, UpImageCompressed
+    with the same payloads compressed by `delta_encode`. With
+    `line_rate` (baud, 10 bits per byte) the replies are paced like a real
+    UART; SetBaudRate switches the pace to the negotiated rate. GetImage
+    reports `finger_polls` NoFingerDetected before it succeeds, and keeps
+    reporting NoFingerDetected while `finger` is cleared, as the sketch
+    polling an empty sensor.
+
+    `port_name` is a link to the current pseudo terminal, as the
+    /dev/serial/by-id links, so that `unplug` can make the port fail and
+    vanish and `replug` bring it back under the same name.
+    """
+
+    def __init__(
+        self,
+        image_bytes: bytes,
+        chunk_size: int = 128,
+        line_rate: Optional[int] = None,
+        finger_polls: int = 0,
+    ):
+        if not 0 < chunk_size < 256:
+            raise ValueError(f"Unsupported chunk size: {chunk_size}")
+        self.image_bytes = image_bytes
+        self.chunk_size = chunk_size
+        self.line_rate = line_rate
+        self.finger_polls = finger_polls
+        self.finger = threading.Event()
+        self.finger.set()
+
+        self._link_dir = tempfile.TemporaryDirectory()
+        self.port_name = str(Path(self._link_dir.name) / "ttyAS608")
+        self._master: Optional[int] = None
+        self._plug()
+        self._stopped = threading.Event()
+        self._unplugged = threading.Event()
+        self._replugged = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    def __enter__(self) -> "FakeAS608":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._stopped.set()
+        self._replugged.set()
+        self._thread.join()
+        if self._master is not None:
+            self._pull()
+        self._link_dir.cleanup()
+
+    def unplug(self) -> None:
+        """Pull the cable, until `replug`"""
+        self._replugged.clear()
+        self._unplugged.set()
+
+    def replug(self) -> None:
+        self._replugged.set()
+
+    def _plug(self) -> None:
+        self._master, slave = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(slave)
+        os.symlink(os.ttyname(slave), self.port_name)
+        # With no slave open, reading the master fails with EIO; that is
+        # how the first open by the host is noticed
+        os.close(slave)
+
+    def _pull(self) -> None:
+        """Close the pseudo terminal, the host's reads fail from now on"""
+        os.unlink(self.port_name)
+        os.close(self._master)
+        self._master = None
+
+    def _connected(self) -> bool:
+        return not (self._stopped.is_set() or self._unplugged.is_set())
+
+    def _write(self, data: bytes) -> None:
+        """
+        Write at the simulated line rate. Left unread, as when the host
+        closed the port mid-transfer, the data is dropped once stopped or
+        unplugged rather than blocking on the full pty.
+        """
+        start = time.perf_counter()
+        view = memoryview(data)
+        while view:
+            _, ready, _ = select.select([], [self._master], [], 0.05)
+            if ready:
+                view = view[os.write(self._master, view) :]
+            elif not self._connected():
+                return
+        if self.line_rate:
+            delay = len(data) * 10 / self.line_rate
+            time.sleep(max(0.0, start + delay - time.perf_counter()))
+
+    def _read(self, n: int) -> Optional[bytes]:
+        """`n` bytes from the host, None once stopped or disconnected"""
+        data = b""
+        while len(data) < n:
+            if not self._connected():
+                return None
+            ready, _, _ = select.select([self._master], [], [], 0.05)
+            if not ready:
+                continue
+            try:
+                data += os.read(self._master, n - len(data))
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+                return None
+        return data
+
+    def _host_closed(self) -> bool:
+        """
+        Whether the host closed the port, as the Arduino resets then. What
+        it sent meanwhile is dropped, the sketch does not read while it
+        polls the sensor.
+        """
+        while select.select([self._master], [], [], 0)[0]:
+            try:
+                os.read(self._master, 1024)
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+                return True
+        return False
+
+    def _wait_for_host(self) -> bool:
+        while self._connected():
+            ready, _, _ = select.select([self._master], [], [], 0.01)
+            if not ready:
+                # Let the host finish opening, pyserial flushes the input
+                time.sleep(0.1)
+                return True
+            try:
+                os.read(self._master, 1)
+            except OSError as e:
+                if e.errno != errno.EIO:
+                    raise
+                time.sleep(0.01)
+        return False
+
+    def _serve(self) -> None:
+        while not self._stopped.is_set():
+            if self._wait_for_host():
+                self._write(
+                    bytes(
+                        [
+                            DeviceState.Initialization.value,
+                            DeviceState.InitializationComplete.value,
+                        ]
+                    )
+                )
+                while (command := self._read(1)) is not None:
+                    self._handle(command[0])
+            if self._unplugged.is_set():
+                self._pull()
+                self._unplugged.clear()
+                self._replugged.wait()
+                if not self._stopped.is_set():
+                    self._plug()
+
+    def _handle(self, command: int) -> None:
+        if command == Command.GetImage.value:
+            self._write(
+                bytes([DeviceState.NoFingerDetected.value] * self.finger_polls)
+            )
+            while not self.finger.wait(0.05):
+                if not self._connected() or self._host_closed():
+                    return
+                self._write(bytes([DeviceState.NoFingerDetected.value]))
+            self._write(bytes([DeviceState.CommandSuccess.value]))
+        elif command == Command.UpImage.value:
+            self._up_image()
+        elif command == Command.UpImageCompressed.value:
+            self._up_image(compressed=True)
+        elif command == Command.WriteReg.value:
+            if self._read(2) is not None:
+                self._write(bytes([DeviceState.CommandSuccess.value]))
+        elif command == Command.PrintDeviceParameters.value:
+            self._write(
+                b"Status register: 0x0\r\nSystem ID: 0x9\r\n"
+                b"Finger library size: 300\r\nSecurity level: 3\r\n"
+                b"Device address: 0xFFFFFFFF\r\nPacket length: 128\r\n"
+                b"Baud rate: 57600\r\n"
+                + bytes([DeviceState.CommandSuccess.value])
+            )
+        elif command == Command.SetBaudRate.value:
+            index = self._read(1)
+            if index is None or index[0] >= len(BAUD_RATES):
+                self._write(bytes([DeviceState.CommandFailed.value]))
+                return
+            self._write(bytes([DeviceState.CommandSuccess.value]))
+            ack = self._read(1)
+            if ack is not None and ack[0] == Command.Acknowledgement.value:
+                if self.line_rate:
+                    self.line_rate = BAUD_RATES[index[0]]
+                self._write(bytes([DeviceState.CommandSuccess.value]))
+
+    def _up_image(self, compressed: bool = False) -> None:
+        frame_type = DeviceState.DataStart
+        if compressed:
+            frame_type = DeviceState.CompressedData
+        frames = bytearray()
+        for start in range(0, len(self.image_bytes), self.chunk_size):
+            payload = self.image_bytes[start : start + self.chunk_size]
+            if compressed:
+                payload = delta_encode(payload)
+            frames += bytes([frame_type.value, len(payload)])
+            frames += payload
+            frames += bytes([DeviceState.DataEnd.value])
+            # Pace and hand over one sensor packet at a time, as the sketch
+            if self.line_rate:
+                self._write(bytes(frames))
+                frames.clear()
+        frames += bytes([DeviceState.CommandSuccess.value])
+        self._write(bytes(frames))
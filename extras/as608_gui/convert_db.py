@@ -0,0 +1,86 @@
+import argparse
+from pathlib import Path
+
+from fingerprint_matcher import (
+    DERIVED_IMAGES,
+    Fingerprint,
+    load_capture,
+    save_template,
+)
+from image_codec import pack_nibbles
+
+
+def folder_size(fp_dir: Path) -> int:
+    return sum(path.stat().st_size for path in fp_dir.iterdir())
+
+
+def convert(fp_dir: Path, keep_images: bool = False) -> bool:
+    """
+    Convert an enrollment folder to the compact layout in place: the
+    capture as its packed UpImage payload, `capture.raw`, next to
+    `template.npz`. Returns False, leaving the folder as is, when the
+    capture is not a 4-bit sensor image.
+    """
+    bmp_path = fp_dir / "original.bmp"
+    raw_path = fp_dir / "capture.raw"
+    template_path = fp_dir / "template.npz"
+
+    if bmp_path.exists():
+        img = load_capture(bmp_path)
+        if img.shape != (288, 256):
+            return False
+        try:
+            image_bytes = pack_nibbles(img)
+        except ValueError:
+            return False
+        raw_path.write_bytes(image_bytes)
+        bmp_path.unlink()
+    elif not raw_path.exists():
+        return False
+
+    if not template_path.exists():
+        fp = Fingerprint(load_capture(raw_path), features_only=True)
+        save_template(template_path, fp.minutiae)
+
+    if not keep_images:
+        for name in DERIVED_IMAGES:
+            (fp_dir / name).unlink(missing_ok=True)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert db/<name>/ folders of BMPs to packed captures"
+    )
+    parser.add_argument(
+        "db",
+        type=Path,
+        nargs="?",
+        default=Path(__file__).parent / "db",
+        help="database directory to convert in place",
+    )
+    parser.add_argument(
+        "--keep-images",
+        action="store_true",
+        help="keep the enhanced, skeleton, aligned and result images",
+    )
+    args = parser.parse_args()
+
+    before = after = n_converted = 0
+    for fp_dir in sorted(path for path in args.db.iterdir() if path.is_dir()):
+        size = folder_size(fp_dir)
+        if convert(fp_dir, args.keep_images):
+            n_converted += 1
+        else:
+            print(f"Skipped {fp_dir.name}: no 4-bit sensor capture")
+        before += size
+        after += folder_size(fp_dir)
+
+    print(
+        f"Converted {n_converted} enrollments, "
+        f"{before / 1024:.0f} KiB -> {after / 1024:.0f} KiB"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,82 @@
+import argparse
+import math
+import os
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
+from functools import cache, cached_property
+from collections.abc import Sequence as SequenceABC
 from pathlib import Path
-from typing import Sequence
+from typing import Callable, Iterable, Iterator, Optional, Sequence
 
 import numpy as np
 import cv2
 import skimage
-from skimage.morphology import skeletonize
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import ndimage, signal
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from skimage.morphology import convex_hull_image, erosion, skeletonize
+from tqdm import tqdm
 
 from cv2.typing import MatLike
 from numpy.typing import NDArray
 
-from fingerprint_enhancer import enhance_Fingerprint
+from fingerprint_enhancer import FingerprintImageEnhancer
 from fingerprint_feature_extractor import extract_minutiae_features
+from image_codec import pack_nibbles, unpack_nibbles
+from image_quality import BLOCK_SIZE, block_variance
+from profiling import profiler
+
+
+# Bump whenever a change to the pipeline alters the minutiae it extracts,
+# cached templates of other versions are then ignored
+PIPELINE_VERSION = 1
+
+MINUTIA_TYPES = ("termination", "bifurcation")
+DISTANCE_TOLERANCE = 17.5
+ANGLE_TOLERANCE = 30
+
+# enhance_Fingerprint's default ridge_segment_thresh: blocks whose standard
+# deviation is below this fraction of the image's are background
+RIDGE_SEGMENT_THRESH = 0.1
+# Background kept around the ridges when cropping, a multiple of BLOCK_SIZE
+# covering the enhancer's orientation smoothing and Gabor filter support
+ROI_PADDING = 48
+# Pixels per task of the tiled Gabor filter
+GABOR_CHUNK = 1024
+# extract_minutiae_features' default: terminations closer than this to
+# another termination are spurious
+SPURIOUS_MINUTIAE_THRESH = 10
+MINUTIAE_BACKENDS = ("vectorized", "reference")
+# Images `Fingerprint.save` can write next to the capture, by attribute
+DERIVED_IMAGES = {
+    "enhanced.bmp": "enhanced_img",
+    "skeleton.bmp": "skeleton_img",
+    "aligned.bmp": "aligned_img",
+    "result.bmp": "result_img",
+}
+
+# Threads each enhancement runs on, see `set_enhance_workers`
+enhance_workers = os.cpu_count() or 1
+
+
+# Packed record of one minutia, 9 bytes; "type" indexes MINUTIA_TYPES
+MINUTIA_DTYPE = np.dtype(
+    [
+        ("x", np.int16),
+        ("y", np.int16),
+        ("angle", np.float32),
+        ("type", np.uint8),
+    ]
+)
 
 
 class Minutia:
+    __slots__ = ("x", "y", "angle", "type")
+
     def __init__(self, x: int, y: int, angle: float, type: str):
         self.x = x
         self.y = y
@@ -31,9 +94,55 @@ class Minutia:
         d = distance(self, __value)
         da = angle_difference(self.angle, __value.angle)
         if minutia_type == "termination":
-            return d <= 17.5 and da <= 30
+            return d <= DISTANCE_TOLERANCE and da <= ANGLE_TOLERANCE
         else:
-            return d <= 17.5
+            return d <= DISTANCE_TOLERANCE
+
+
+class MinutiaSet(SequenceABC):
+    """
+    Minutiae stored as one `MINUTIA_DTYPE` structured array.
+
+    Behaves like a sequence of `Minutia` (indexing materializes one on the
+    fly), while the matchers and templates use `data` directly.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: NDArray | None = None):
+        if data is None:
+            data = np.empty(0, dtype=MINUTIA_DTYPE)
+        self.data = np.asarray(data, dtype=MINUTIA_DTYPE)
+
+    @classmethod
+    def from_minutiae(cls, minutiae: Iterable[Minutia]) -> "MinutiaSet":
+        if isinstance(minutiae, MinutiaSet):
+            return minutiae
+        return cls(
+            np.array(
+                [
+                    (m.x, m.y, m.angle, MINUTIA_TYPES.index(m.type))
+                    for m in minutiae
+                ],
+                dtype=MINUTIA_DTYPE,
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return MinutiaSet(self.data[index])
+        x, y, angle, type_code = self.data[index].item()
+        return Minutia(x, y, angle, MINUTIA_TYPES[type_code])
+
+    def __iter__(self) -> Iterator[Minutia]:
+        for x, y, angle, type_code in self.data.tolist():
+            yield Minutia(x, y, angle, MINUTIA_TYPES[type_code])
+
+    def __repr__(self) -> str:
+        return f"MinutiaSet({len(self)} minutiae)"
 
 
 def distance(m1: Minutia, m2: Minutia) -> float:
@@ -65,6 +174,208 @@ def match_minutiae(
     return n_matches
 
 
+def minutiae_arrays(
+    minutiae: Sequence[Minutia],
+) -> tuple[NDArray, NDArray, NDArray, NDArray]:
+    """Split minutiae into x, y, angle and type code arrays"""
+    if isinstance(minutiae, MinutiaSet):
+        return (
+            minutiae.data["x"].astype(np.float64),
+            minutiae.data["y"].astype(np.float64),
+            minutiae.data["angle"].astype(np.float64),
+            minutiae.data["type"],
+        )
+    return (
+        np.array([m.x for m in minutiae], dtype=np.float64),
+        np.array([m.y for m in minutiae], dtype=np.float64),
+        np.array([m.angle for m in minutiae], dtype=np.float64),
+        np.array(
+            [MINUTIA_TYPES.index(m.type) for m in minutiae], dtype=np.uint8
+        ),
+    )
+
+
+def compatibility_matrix(
+    minutiae1: Sequence[Minutia], minutiae2: Sequence[Minutia]
+) -> NDArray[np.bool_]:
+    """
+    Evaluate `Minutia.__eq__` for every pair of minutiae at once.
+
+    Entry (i, j) tells whether minutiae1[i] and minutiae2[j] match.
+    """
+    x1, y1, a1, t1 = minutiae_arrays(minutiae1)
+    x2, y2, a2, t2 = minutiae_arrays(minutiae2)
+
+    dx = x1[:, None] - x2[None, :]
+    dy = y1[:, None] - y2[None, :]
+    d = np.sqrt(dx * dx + dy * dy)
+    da = np.abs((a1[:, None] - a2[None, :] + 180) % 360 - 180)
+
+    is_termination = (t1 == MINUTIA_TYPES.index("termination"))[:, None]
+    return (
+        (t1[:, None] == t2[None, :])
+        & (d <= DISTANCE_TOLERANCE)
+        & (~is_termination | (da <= ANGLE_TOLERANCE))
+    )
+
+
+def compatible_pairs(
+    minutiae1: Sequence[Minutia], minutiae2: Sequence[Minutia]
+) -> tuple[NDArray[np.intp], NDArray[np.intp]]:
+    """
+    Same pairs as `np.nonzero(compatibility_matrix(...))`, but only pairs
+    closer than the distance tolerance are ever looked at: a KD-tree over
+    each set's positions prunes the rest, so the cost follows the number of
+    nearby pairs instead of len(minutiae1) * len(minutiae2).
+    """
+    x1, y1, a1, t1 = minutiae_arrays(minutiae1)
+    x2, y2, a2, t2 = minutiae_arrays(minutiae2)
+
+    tree1 = cKDTree(np.column_stack((x1, y1)))
+    tree2 = cKDTree(np.column_stack((x2, y2)))
+    # Query slightly wider, the exact rule is re-checked below
+    near = tree1.sparse_distance_matrix(
+        tree2, DISTANCE_TOLERANCE + 1e-6, output_type="ndarray"
+    )
+    rows, cols = near["i"], near["j"]
+
+    dx = x1[rows] - x2[cols]
+    dy = y1[rows] - y2[cols]
+    da = np.abs((a1[rows] - a2[cols] + 180) % 360 - 180)
+    keep = (
+        (t1[rows] == t2[cols])
+        & (np.sqrt(dx * dx + dy * dy) <= DISTANCE_TOLERANCE)
+        & (
+            (t1[rows] != MINUTIA_TYPES.index("termination"))
+            | (da <= ANGLE_TOLERANCE)
+        )
+    )
+    rows, cols = rows[keep], cols[keep]
+
+    order = np.lexsort((cols, rows))
+    return rows[order], cols[order]
+
+
+def greedy_assignment(compatible: NDArray[np.bool_]) -> int:
+    """
+    Pair every row with the first still unmatched compatible column, in
+    order, exactly like `match_minutiae` does.
+    """
+    rows, cols = np.nonzero(compatible)
+    return greedy_pair_count(rows, cols)
+
+
+def greedy_pair_count(rows: NDArray, cols: NDArray) -> int:
+    """
+    Greedy one-to-one matching over compatible (row, col) pairs, which must
+    be sorted by row and then by column.
+    """
+    n_matches = 0
+    matched_cols = set()
+    matched_row = -1
+    for row, col in zip(rows.tolist(), cols.tolist()):
+        if row == matched_row or col in matched_cols:
+            continue
+        matched_cols.add(col)
+        matched_row = row
+        n_matches += 1
+    return n_matches
+
+
+def optimal_assignment(compatible: NDArray[np.bool_]) -> int:
+    """Largest possible one-to-one matching (Hungarian algorithm)"""
+    rows, cols = linear_sum_assignment(compatible, maximize=True)
+    return int(np.count_nonzero(compatible[rows, cols]))
+
+
+def match_minutiae_vectorized(
+    minutiae1: Sequence[Minutia],
+    minutiae2: Sequence[Minutia],
+    assignment: str = "greedy",
+    spatial_index: bool = False,
+) -> int:
+    """
+    Match two fingerprints based on their minutiae, comparing all pairs at
+    once. With `assignment="greedy"` the result equals `match_minutiae`;
+    `assignment="hungarian"` finds the maximum one-to-one matching instead.
+    `spatial_index=True` prunes distant pairs with a KD-tree, which pays
+    off for large minutiae sets.
+    """
+    if assignment not in ("greedy", "hungarian"):
+        raise ValueError(f"Unknown assignment: {assignment}")
+    if len(minutiae1) == 0 or len(minutiae2) == 0:
+        return 0
+
+    if spatial_index:
+        rows, cols = compatible_pairs(minutiae1, minutiae2)
+        if assignment == "greedy":
+            return greedy_pair_count(rows, cols)
+        compatible = np.zeros((len(minutiae1), len(minutiae2)), dtype=bool)
+        compatible[rows, cols] = True
+    else:
+        compatible = compatibility_matrix(minutiae1, minutiae2)
+
+    if assignment == "greedy":
+        return greedy_assignment(compatible)
+    return optimal_assignment(compatible)
+
+
+def save_template(path: Path, minutiae: Sequence[Minutia]) -> None:
+    """
+    Save minutiae as a compact .npz template, along with the
+    `PIPELINE_VERSION` that extracted them
+    """
+    data = MinutiaSet.from_minutiae(minutiae).data
+    with open(path, "wb") as f:
+        np.savez(
+            f,
+            x=data["x"],
+            y=data["y"],
+            angle=data["angle"],
+            type=data["type"],
+            pipeline_version=PIPELINE_VERSION,
+        )
+
+
+def load_template(path: Path) -> MinutiaSet:
+    """Load the minutiae saved by `save_template`"""
+    with np.load(path) as template:
+        data = np.empty(len(template["x"]), dtype=MINUTIA_DTYPE)
+        for field in MINUTIA_DTYPE.names:
+            data[field] = template[field]
+    return MinutiaSet(data)
+
+
+def template_version(path: Path) -> Optional[int]:
+    """
+    The `PIPELINE_VERSION` a template was extracted with, None when it
+    predates versioned templates or cannot be read
+    """
+    try:
+        with np.load(path) as template:
+            if "pipeline_version" not in template:
+                return None
+            return int(template["pipeline_version"])
+    except (OSError, ValueError):
+        return None
+
+
+def load_capture(path: Path) -> NDArray[np.uint8]:
+    """Load a capture saved as a packed UpImage payload (.raw) or an image"""
+    if path.suffix == ".raw":
+        return unpack_nibbles(path.read_bytes())
+    img = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise ValueError(f"Cannot read {path}")
+    return img
+
+
+def capture_path(fp_dir: Path) -> Path:
+    """The capture of an enrollment folder, packed or as a BMP"""
+    raw_path = fp_dir / "capture.raw"
+    return raw_path if raw_path.exists() else fp_dir / "original.bmp"
+
+
 def align_image(img: MatLike) -> NDArray[np.uint8]:
     """Align the image so that the center of mass is at the center"""
     center_of_mass = np.mean(
@@ -82,51 +393,722 @@ def align_image(img: MatLike) -> NDArray[np.uint8]:
     return cv2.warpAffine(img, translation_matrix, (cols, rows))
 
 
-class Fingerprint:
-    def __init__(self, img: MatLike):
-        self.img = img
-        self.enhanced_img = enhance_Fingerprint(img)
-        self.skeleton_img: NDArray[np.int8] = (
-            np.uint8(skeletonize(self.enhanced_img)) * 255
+def foreground_roi(
+    img: MatLike, padding: int = ROI_PADDING
+) -> tuple[slice, slice]:
+    """
+    Bounding box of the blocks `enhance_Fingerprint` segments as ridges,
+    grown by `padding` and kept on its block grid
+    """
+    rows, cols = img.shape
+    threshold = (RIDGE_SEGMENT_THRESH * np.std(img)) ** 2
+    block_rows, block_cols = np.nonzero(block_variance(img) > threshold)
+    if len(block_rows) == 0:
+        return slice(0, rows), slice(0, cols)
+
+    return (
+        slice(
+            max(block_rows.min() * BLOCK_SIZE - padding, 0),
+            min((block_rows.max() + 1) * BLOCK_SIZE + padding, rows),
+        ),
+        slice(
+            max(block_cols.min() * BLOCK_SIZE - padding, 0),
+            min((block_cols.max() + 1) * BLOCK_SIZE + padding, cols),
+        ),
+    )
+
+
+def set_enhance_workers(workers: int) -> None:
+    """
+    Threads each enhancement runs on; 1 in worker processes, which already
+    keep every core busy
+    """
+    global enhance_workers
+    enhance_workers = workers
+
+
+@cache
+def tile_executor(workers: int) -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(workers, thread_name_prefix="enhance")
+
+
+def gaussian_kernel(sigma: float, odd: bool = True) -> NDArray[np.float64]:
+    """The enhancer's 2D Gaussian, 6 sigma wide"""
+    size = np.fix(6 * sigma)
+    if odd and np.remainder(size, 2) == 0:
+        size = size + 1
+    gauss = cv2.getGaussianKernel(int(size), sigma)
+    return gauss * gauss.T
+
+
+class TileEnhancer(FingerprintImageEnhancer):
+    """
+    `FingerprintImageEnhancer` whose orientation, frequency and Gabor
+    stages run on tiles of the image in `workers` threads. NumPy, SciPy
+    and OpenCV release the GIL in those kernels.
+
+    Convolutions run on row bands overlapping by the kernel's radius, and
+    each band keeps only the rows the overlap makes exact. Ridge frequency
+    runs per block, skipping blocks outside the mask. The Gabor filter
+    runs on chunks of pixels, vectorized. Every value is computed with the
+    same operations in the same order as the stock enhancer, so the output
+    is identical.
+    """
+
+    def __init__(self, workers: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.workers = workers
+
+    def _map(self, func: Callable, items: Sequence) -> list:
+        if self.workers == 1 or len(items) == 1:
+            return [func(item) for item in items]
+        return list(tile_executor(self.workers).map(func, items))
+
+    def _convolve_bands(
+        self,
+        convolve: Callable[[NDArray, NDArray], NDArray],
+        images: Sequence[NDArray],
+        kernels: Sequence[NDArray],
+    ) -> list[NDArray]:
+        """
+        `convolve(image, kernel)` of every pair, each split in as many row
+        bands as it takes to give every worker a task
+        """
+        rows = images[0].shape[0]
+        n_bands = min(-(-self.workers // len(images)), rows)
+        bounds = np.linspace(0, rows, n_bands + 1).astype(int)
+        bands = list(zip(bounds[:-1], bounds[1:]))
+
+        def convolve_band(task: tuple[int, int, int]) -> NDArray:
+            index, start, stop = task
+            halo = kernels[index].shape[0] // 2
+            top = max(start - halo, 0)
+            bottom = min(stop + halo, rows)
+            result = convolve(images[index][top:bottom], kernels[index])
+            return result[start - top : stop - top]
+
+        results = self._map(
+            convolve_band,
+            [(i, *band) for i in range(len(images)) for band in bands],
         )
-        self.aligned_img = align_image(self.skeleton_img)
+        return [
+            np.concatenate(results[i * n_bands : (i + 1) * n_bands])
+            for i in range(len(images))
+        ]
 
-        terminations, bifurcations = extract_minutiae_features(self.aligned_img)
+    def _FingerprintImageEnhancer__ridge_orient(self):
+        def convolve2d(image, kernel):
+            return signal.convolve2d(image, kernel, mode="same")
 
-        self.minutiae = [
-            *[
-                Minutia(t.locX, t.locY, t.Orientation[0], "termination")
-                for t in terminations
-            ],
-            *[
-                Minutia(b.locX, b.locY, b.Orientation[0], "bifurcation")
-                for b in bifurcations
+        fy, fx = np.gradient(gaussian_kernel(self.gradient_sigma))
+        Gx, Gy = self._convolve_bands(
+            convolve2d, [self._normim, self._normim], [fx, fy]
+        )
+
+        block_kernel = gaussian_kernel(self.block_sigma, odd=False)
+        Gxx, Gyy, Gxy = self._convolve_bands(
+            ndimage.convolve,
+            [np.power(Gx, 2), np.power(Gy, 2), Gx * Gy],
+            [block_kernel] * 3,
+        )
+        Gxy = 2 * Gxy
+
+        denom = (
+            np.sqrt(np.power(Gxy, 2) + np.power((Gxx - Gyy), 2))
+            + np.finfo(float).eps
+        )
+        sin2theta = Gxy / denom
+        cos2theta = (Gxx - Gyy) / denom
+
+        if self.orient_smooth_sigma:
+            smooth_kernel = gaussian_kernel(self.orient_smooth_sigma)
+            cos2theta, sin2theta = self._convolve_bands(
+                ndimage.convolve,
+                [cos2theta, sin2theta],
+                [smooth_kernel] * 2,
+            )
+
+        self._orientim = np.pi / 2 + np.arctan2(sin2theta, cos2theta) / 2
+
+    def _FingerprintImageEnhancer__ridge_freq(self):
+        size = self.ridge_freq_blksze
+        rows, cols = self._normim.shape
+        # A block outside the mask is zeroed by it, skip estimating it
+        blocks = [
+            (slice(r, r + size), slice(c, c + size))
+            for r in range(0, rows - size, size)
+            for c in range(0, cols - size, size)
+            if self._mask[r : r + size, c : c + size].any()
+        ]
+
+        def estimate(block: tuple[slice, slice]) -> NDArray:
+            return self._FingerprintImageEnhancer__frequest(
+                self._normim[block], self._orientim[block]
+            )
+
+        freq = np.zeros((rows, cols))
+        for block, block_freq in zip(blocks, self._map(estimate, blocks)):
+            freq[block] = block_freq
+
+        self._freq = freq * self._mask
+        nonzero_freq = self._freq[self._freq > 0]
+        if len(nonzero_freq) != 0:
+            self._mean_freq = np.mean(nonzero_freq)
+            self._median_freq = np.median(nonzero_freq)
+        else:
+            self._mean_freq = 0
+            self._median_freq = 0
+        self._freq = self._mean_freq * self._mask
+
+    def gabor_filters(self, freq: float) -> NDArray[np.float64]:
+        """The Gabor filter of `freq` rotated every `angleInc` degrees"""
+        sigmax = 1 / freq * self.kx
+        sigmay = 1 / freq * self.ky
+        size = int(np.round(3 * np.max([sigmax, sigmay])))
+        x, y = np.meshgrid(
+            np.linspace(-size, size, (2 * size + 1)),
+            np.linspace(-size, size, (2 * size + 1)),
+        )
+        reffilter = np.exp(
+            -(
+                (
+                    (np.power(x, 2)) / (sigmax * sigmax)
+                    + (np.power(y, 2)) / (sigmay * sigmay)
+                )
+            )
+        ) * np.cos(2 * np.pi * freq * x)
+
+        # The orientation image gives the direction along the ridges, and
+        # rotate turns anticlockwise
+        return np.array(
+            [
+                ndimage.rotate(
+                    reffilter, -(o * self.angleInc + 90), reshape=False
+                )
+                for o in range(int(180 / self.angleInc))
+            ]
+        )
+
+    def _FingerprintImageEnhancer__ridge_filter(self):
+        im = np.double(self._normim)
+        rows, cols = im.shape
+
+        # Frequencies are rounded to 0.01, the filters use the lowest
+        nonzero_freq = np.round(self._freq[self._freq > 0] * 100) / 100
+        filters = self.gabor_filters(np.unique(nonzero_freq)[0])
+        size = filters.shape[1] // 2
+
+        # Orientation as a 1-based index into the filters
+        max_index = np.round(180 / self.angleInc)
+        orient_index = np.round(self._orientim / np.pi * 180 / self.angleInc)
+        orient_index[orient_index < 1] += max_index
+        orient_index[orient_index > max_index] -= max_index
+        orient_index = orient_index.astype(np.intp) - 1
+
+        # Pixels with a frequency whose filter fits inside the image
+        valid_rows, valid_cols = np.nonzero(self._freq > 0)
+        inside = (
+            (valid_rows > size)
+            & (valid_rows < rows - size)
+            & (valid_cols > size)
+            & (valid_cols < cols - size)
+        )
+        valid_rows, valid_cols = valid_rows[inside], valid_cols[inside]
+
+        windows = sliding_window_view(im, filters.shape[1:])
+
+        def filter_chunk(chunk: slice) -> NDArray[np.float64]:
+            r, c = valid_rows[chunk], valid_cols[chunk]
+            products = windows[r - size, c - size] * filters[orient_index[r, c]]
+            return products.reshape(len(r), -1).sum(axis=1)
+
+        chunks = [
+            slice(start, start + GABOR_CHUNK)
+            for start in range(0, len(valid_rows), GABOR_CHUNK)
+        ]
+        newim = np.zeros((rows, cols))
+        if chunks:
+            newim[valid_rows, valid_cols] = np.concatenate(
+                self._map(filter_chunk, chunks)
+            )
+        self._binim = newim < self.ridge_filter_thresh
+
+
+class RoiEnhancer(TileEnhancer):
+    """
+    Enhancer for the `roi` crop of a `frame_shape` image. The ridge
+    frequency is the only estimate taken over the whole image, on blocks
+    anchored at its origin; it is computed on the crop placed back in
+    the frame so that the blocks do not move with the crop.
+    """
+
+    def __init__(
+        self, frame_shape: tuple[int, int], roi: tuple[slice, slice], **kwargs
+    ):
+        super().__init__(**kwargs)
+        self.frame_shape = frame_shape
+        self.roi = roi
+
+    def _FingerprintImageEnhancer__ridge_freq(self):
+        crop = (self._normim, self._orientim, self._mask)
+        for name, image in zip(("_normim", "_orientim", "_mask"), crop):
+            frame = np.zeros(self.frame_shape, dtype=image.dtype)
+            frame[self.roi] = image
+            setattr(self, name, frame)
+
+        super()._FingerprintImageEnhancer__ridge_freq()
+
+        self._normim, self._orientim, self._mask = crop
+        self._freq = self._freq[self.roi]
+
+
+def enhance_roi(
+    img: MatLike, roi: tuple[slice, slice], workers: int = 1
+) -> NDArray[np.uint8]:
+    """
+    `enhance_Fingerprint(img)` computed on the `roi` crop only, in
+    `workers` threads. The segmentation threshold is rescaled to the
+    crop's contrast so the enhancer picks the same ridge blocks as it
+    would on the whole frame.
+    """
+    crop = img[roi]
+    threshold = RIDGE_SEGMENT_THRESH * np.std(img) / np.std(crop)
+    enhancer = RoiEnhancer(
+        img.shape, roi, workers=workers, ridge_segment_thresh=threshold
+    )
+    enhanced = np.zeros(img.shape, dtype=np.uint8)
+    enhanced[roi] = enhancer.enhance(crop, resize=False)
+    return enhanced
+
+
+def reference_minutiae(skeleton: NDArray[np.uint8]) -> MinutiaSet:
+    """Minutiae found by `extract_minutiae_features`"""
+    terminations, bifurcations = extract_minutiae_features(skeleton)
+    termination = MINUTIA_TYPES.index("termination")
+    bifurcation = MINUTIA_TYPES.index("bifurcation")
+    return MinutiaSet(
+        np.array(
+            [
+                *[
+                    (t.locX, t.locY, t.Orientation[0], termination)
+                    for t in terminations
+                ],
+                *[
+                    (b.locX, b.locY, b.Orientation[0], bifurcation)
+                    for b in bifurcations
+                ],
             ],
+            dtype=MINUTIA_DTYPE,
+        )
+    )
+
+
+def label_centroids(points: NDArray[np.bool_]) -> NDArray[np.float64]:
+    """(row, col) centroid of each 8-connected region, in label order"""
+    labels, n_labels = ndimage.label(points, structure=np.ones((3, 3)))
+    rows, cols = np.nonzero(labels)
+    index = labels[rows, cols]
+    counts = np.bincount(index, minlength=n_labels + 1)[1:]
+    return np.column_stack(
+        [
+            np.bincount(index, rows, n_labels + 1)[1:] / counts,
+            np.bincount(index, cols, n_labels + 1)[1:] / counts,
+        ]
+    )
+
+
+def window_directions(
+    skeleton: NDArray[np.bool_],
+    centers: NDArray[np.intp],
+    radius: int,
+    n_branches: int,
+) -> tuple[NDArray[np.intp], list[float]]:
+    """
+    Trace the ridges leaving each center through the border of its
+    (2 * radius + 1)² window: keep the centers whose border crosses exactly
+    `n_branches` ridge pixels, with the direction of the first one in
+    raster order. Windows are clipped at the bottom and right edges and
+    dropped past the top and left ones, as `extract_minutiae_features`
+    slices them.
+    """
+    rows, cols = skeleton.shape
+    centers = centers[(centers[:, 0] >= radius) & (centers[:, 1] >= radius)]
+    size = 2 * radius + 1
+    heights = np.minimum(rows - centers[:, 0] + radius, size)[:, None]
+    widths = np.minimum(cols - centers[:, 1] + radius, size)[:, None]
+
+    i, j = (offsets.reshape(-1) for offsets in np.indices((size, size)))
+    padded = np.pad(skeleton, ((0, radius), (0, radius)))
+    border = (
+        (i < heights)
+        & (j < widths)
+        & ((i == 0) | (i == heights - 1) | (j == 0) | (j == widths - 1))
+        & padded[
+            centers[:, :1] - radius + i, centers[:, 1:] - radius + j
         ]
+    )
+    keep = np.count_nonzero(border, axis=1) == n_branches
+    first = np.argmax(border[keep], axis=1)
+
+    # The window center is taken from its clipped size, rows for x
+    center_x = (heights[keep, 0] - 1) / 2
+    center_y = (widths[keep, 0] - 1) / 2
+    angles = [
+        -math.degrees(math.atan2(i[k] - cy, j[k] - cx))
+        for k, cx, cy in zip(first.tolist(), center_x, center_y)
+    ]
+    return centers[keep], angles
+
+
+def vectorized_minutiae(
+    skeleton: NDArray[np.uint8],
+    spurious_thresh: float = SPURIOUS_MINUTIAE_THRESH,
+) -> MinutiaSet:
+    """
+    `extract_minutiae_features` with array operations. A ridge pixel with
+    one neighbor ends a ridge, one with three splits it; neighbors are
+    counted with one 3x3 convolution. Terminations are kept inside the
+    eroded convex hull of the ridges, and pairs closer than
+    `spurious_thresh` (found with a KD-tree) are dropped. Orientations
+    come from the ridge pixels on each minutia's window border.
+    """
+    ridges = skeleton > 128
+    skel = skeletonize(ridges)
+    neighbors = ndimage.correlate(
+        skel.astype(np.uint8), np.ones((3, 3), np.uint8), mode="constant"
+    )
+    interior = np.zeros_like(skel)
+    interior[1:-1, 1:-1] = True
+    candidates = skel & interior
+
+    hull = erosion(convex_hull_image(ridges), np.ones((5, 5), np.uint8))
+    terminations = candidates & (neighbors == 2) & hull
+    bifurcations = candidates & (neighbors == 4)
+
+    centroids = label_centroids(terminations)
+    pairs = cKDTree(centroids).query_pairs(
+        spurious_thresh, output_type="ndarray"
+    )
+    # query_pairs includes pairs exactly `spurious_thresh` apart
+    offsets = centroids[pairs[:, 0]] - centroids[pairs[:, 1]]
+    dists = np.sqrt(np.sum(offsets**2, axis=1))
+    spurious = np.zeros(len(centroids), dtype=bool)
+    spurious[pairs[dists < spurious_thresh].reshape(-1)] = True
+
+    kept = np.zeros_like(skel)
+    kept_points = centroids[~spurious].astype(np.int16)
+    kept[kept_points[:, 0], kept_points[:, 1]] = True
+    term_centers = np.round(label_centroids(kept)).astype(np.intp)
+    bif_centers = np.round(label_centroids(bifurcations)).astype(np.intp)
 
-        self.result_img = cv2.cvtColor(self.aligned_img, cv2.COLOR_GRAY2BGR)
-        for t in terminations:
-            (rr, cc) = skimage.draw.circle_perimeter(t.locX, t.locY, 3)
-            skimage.draw.set_color(self.result_img, (rr, cc), (0, 0, 255))
-        for b in bifurcations:
-            (rr, cc) = skimage.draw.circle_perimeter(b.locX, b.locY, 3)
-            skimage.draw.set_color(self.result_img, (rr, cc), (255, 0, 0))
+    term_centers, term_angles = window_directions(skel, term_centers, 2, 1)
+    bif_centers, bif_angles = window_directions(skel, bif_centers, 1, 3)
 
-    def save(self, db_dir: Path, name: str):
+    data = np.empty(len(term_centers) + len(bif_centers), dtype=MINUTIA_DTYPE)
+    centers = np.concatenate([term_centers, bif_centers])
+    data["x"] = centers[:, 0]
+    data["y"] = centers[:, 1]
+    data["angle"] = term_angles + bif_angles
+    data["type"] = np.repeat(
+        [
+            MINUTIA_TYPES.index("termination"),
+            MINUTIA_TYPES.index("bifurcation"),
+        ],
+        [len(term_centers), len(bif_centers)],
+    )
+    return MinutiaSet(data)
+
+
+def skeleton_minutiae(
+    skeleton: NDArray[np.uint8], backend: str = "vectorized"
+) -> MinutiaSet:
+    """
+    Minutiae of a skeleton image, extracted by `backend` (one of
+    `MINUTIAE_BACKENDS`) from the bounding box of its ridges. The box
+    keeps a margin for the extractor's 5x5 windows and starts on even
+    coordinates, so centroids round exactly as they would on the full
+    frame.
+    """
+    extractors = {
+        "vectorized": vectorized_minutiae,
+        "reference": reference_minutiae,
+    }
+    if backend not in extractors:
+        raise ValueError(f"Unknown minutiae backend: {backend}")
+
+    rows, cols = np.nonzero(skeleton)
+    if len(rows) == 0:
+        return MinutiaSet()
+
+    margin = 4
+    top = max(rows.min() - margin, 0) & ~1
+    left = max(cols.min() - margin, 0) & ~1
+    bottom = rows.max() + margin + 1
+    right = cols.max() + margin + 1
+    data = extractors[backend](skeleton[top:bottom, left:right]).data
+    data["x"] += top
+    data["y"] += left
+    return MinutiaSet(data)
+
+
+class Fingerprint:
+    """
+    A fingerprint image and its minutiae.
+
+    The intermediate images are computed on first access and cached. With
+    `features_only=True` they are dropped once the minutiae are extracted,
+    keeping only `img` and `minutiae`; accessing them again recomputes them.
+    Enhancement and skeletonization only run inside `roi`, the padded
+    bounding box of the finger; the images stay full frame.
+    """
+
+    # The cached intermediate images, in pipeline order
+    image_names = ("enhanced_img", "skeleton_img", "aligned_img", "result_img")
+    # One of MINUTIAE_BACKENDS
+    minutiae_backend = "vectorized"
+
+    def __init__(self, img: MatLike, features_only: bool = False):
+        self.img = img
+        self.roi = foreground_roi(img)
+        aligned_img = self.aligned_img
+        with profiler.stage("extract"):
+            self.minutiae = skeleton_minutiae(
+                aligned_img, self.minutiae_backend
+            )
+
+        if features_only:
+            self.drop_images()
+
+    @classmethod
+    def from_minutiae(
+        cls, img: MatLike, minutiae: MinutiaSet, **images: NDArray[np.uint8]
+    ) -> "Fingerprint":
+        """
+        A Fingerprint whose minutiae, and optionally some of the images
+        named in `image_names`, are already known, skipping the pipeline
+        """
+        unknown = images.keys() - set(cls.image_names)
+        if unknown:
+            raise ValueError(f"Unknown images: {', '.join(sorted(unknown))}")
+
+        fp = cls.__new__(cls)
+        fp.img = img
+        fp.roi = foreground_roi(img)
+        fp.minutiae = minutiae
+        fp.__dict__.update(images)
+        return fp
+
+    @cached_property
+    def enhanced_img(self) -> NDArray:
+        with profiler.stage("enhance"):
+            return enhance_roi(self.img, self.roi, enhance_workers)
+
+    @cached_property
+    def skeleton_img(self) -> NDArray[np.uint8]:
+        enhanced_img = self.enhanced_img
+        with profiler.stage("skeletonize"):
+            skeleton_img = np.zeros(self.img.shape, dtype=np.uint8)
+            skeleton_img[self.roi] = skeletonize(enhanced_img[self.roi])
+            return skeleton_img * 255
+
+    @cached_property
+    def aligned_img(self) -> NDArray[np.uint8]:
+        skeleton_img = self.skeleton_img
+        with profiler.stage("align"):
+            return align_image(skeleton_img)
+
+    @cached_property
+    def result_img(self) -> NDArray[np.uint8]:
+        result_img = cv2.cvtColor(self.aligned_img, cv2.COLOR_GRAY2BGR)
+        for m in self.minutiae:
+            color = (0, 0, 255) if m.type == "termination" else (255, 0, 0)
+            (rr, cc) = skimage.draw.circle_perimeter(m.x, m.y, 3)
+            skimage.draw.set_color(result_img, (rr, cc), color)
+        return result_img
+
+    def drop_images(self) -> None:
+        """Free the cached intermediate images"""
+        for name in self.image_names:
+            self.__dict__.pop(name, None)
+
+    def save(self, db_dir: Path, name: str, images: bool = False):
+        """
+        Save the capture and its template to `db_dir/name`. A sensor image
+        is stored as its packed UpImage payload, `capture.raw`, anything
+        else as `original.bmp`; a previous capture in the other format is
+        removed. The derived images can be regenerated from the capture,
+        they are only written with `images=True` and removed otherwise, as
+        they would belong to a previous capture.
+        """
         fp_dir = db_dir / name
         fp_dir.mkdir(exist_ok=True)
-        cv2.imwrite(str(fp_dir / "original.bmp"), self.img)
-        cv2.imwrite(str(fp_dir / "enhanced.bmp"), self.enhanced_img)
-        cv2.imwrite(str(fp_dir / "skeleton.bmp"), self.skeleton_img)
-        cv2.imwrite(str(fp_dir / "aligned.bmp"), self.aligned_img)
-        cv2.imwrite(str(fp_dir / "result.bmp"), self.result_img)
+        payload = None
+        if self.img.shape == (288, 256):
+            try:
+                payload = pack_nibbles(self.img)
+            except ValueError:
+                # Not made of 4-bit pixels, stored as a BMP
+                pass
+
+        raw_path = fp_dir / "capture.raw"
+        bmp_path = fp_dir / "original.bmp"
+        if payload is not None:
+            raw_path.write_bytes(payload)
+            bmp_path.unlink(missing_ok=True)
+        else:
+            cv2.imwrite(str(bmp_path), self.img)
+            # capture_path prefers capture.raw, a stale one would win
+            raw_path.unlink(missing_ok=True)
+        for file_name, image_name in DERIVED_IMAGES.items():
+            if images:
+                cv2.imwrite(str(fp_dir / file_name), getattr(self, image_name))
+            else:
+                (fp_dir / file_name).unlink(missing_ok=True)
+        save_template(fp_dir / "template.npz", self.minutiae)
+
+
+def enrolled_captures(db_dir: Path) -> dict[str, Path]:
+    """Map enrollment names to their capture in the db layout"""
+    fp_dirs = {
+        path.parent
+        for path in [
+            *db_dir.glob("*/capture.raw"),
+            *db_dir.glob("*/original.bmp"),
+        ]
+    }
+    return {fp_dir.name: capture_path(fp_dir) for fp_dir in fp_dirs}
+
+
+def find_captures(src_dir: Path, loose: bool = True) -> dict[str, Path]:
+    """
+    Map enrollment names to capture images: `<name>/` folders (the db
+    layout) and, with `loose`, `<name>.bmp` or `<name>.raw` scans.
+    """
+    captures = {}
+    if loose:
+        captures = {
+            path.stem: path
+            for path in [*src_dir.glob("*.bmp"), *src_dir.glob("*.raw")]
+        }
+    captures.update(enrolled_captures(src_dir))
+    return captures
+
+
+def is_enrolled(src: Path, db_dir: Path, name: str) -> bool:
+    """
+    Whether `name` already has a template newer than its capture, and
+    extracted by the current pipeline
+    """
+    template_path = db_dir / name / "template.npz"
+    return (
+        template_path.exists()
+        and template_path.stat().st_mtime_ns >= src.stat().st_mtime_ns
+        and template_version(template_path) == PIPELINE_VERSION
+    )
+
+
+def enroll(
+    src: Path,
+    db_dir: Path,
+    name: str,
+    cache_dir: Optional[Path] = None,
+    images: bool = False,
+) -> int:
+    """Run the whole pipeline on one capture, save it, return #minutiae"""
+    img = load_capture(src)
+    # The intermediate images are only kept when they are written out
+    if cache_dir is not None:
+        # template_cache imports this module
+        from template_cache import shared_cache
+
+        fp = shared_cache(cache_dir, keep_images=images).fingerprint(
+            img, features_only=not images
+        )
+    else:
+        fp = Fingerprint(img, features_only=not images)
+    fp.save(db_dir, name, images)
+    return len(fp.minutiae)
 
 
 def main():
-    db_dir = Path(__file__).parent / "db"
-    for fp_path in db_dir.glob("*/original.bmp"):
-        name = fp_path.parent.name
-        print(f"Processing {name}")
+    parser = argparse.ArgumentParser(
+        description="Enroll (or re-index) a directory of fingerprint captures"
+    )
+    parser.add_argument(
+        "src",
+        type=Path,
+        nargs="?",
+        default=Path(__file__).parent / "db",
+        help="directory of <name>.bmp, <name>.raw or <name>/ captures, "
+        "only <name>/ folders are enrolled when it is the database itself",
+    )
+    parser.add_argument(
+        "--db",
+        type=Path,
+        default=Path(__file__).parent / "db",
+        help="database directory to write to",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="number of processes"
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="reprocess captures that are already enrolled",
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        help="template cache directory, skips captures processed before",
+    )
+    parser.add_argument(
+        "--images",
+        action="store_true",
+        help="also write the enhanced, skeleton, aligned and result images",
+    )
+    args = parser.parse_args()
+
+    args.db.mkdir(parents=True, exist_ok=True)
+    # Loose images in the database directory (demo.bmp, ...) are not
+    # users, only its <name>/ folders are re-indexed
+    captures = find_captures(
+        args.src, loose=args.src.resolve() != args.db.resolve()
+    )
+    pending = {
+        name: src
+        for name, src in captures.items()
+        if args.force or not is_enrolled(src, args.db, name)
+    }
+    print(
+        f"{len(captures)} captures, {len(captures) - len(pending)} up to date"
+    )
+
+    n_failed = 0
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=set_enhance_workers,
+        initargs=(1,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                enroll, src, args.db, name, args.cache, args.images
+            ): name
+            for name, src in pending.items()
+        }
+        with tqdm(total=len(futures), desc="Enrolling") as pbar:
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    n_minutiae = future.result()
+                    pbar.set_postfix_str(f"{name}: {n_minutiae} minutiae")
+                except Exception as e:
+                    n_failed += 1
+                    tqdm.write(f"Failed to enroll {name}: {e}")
+                pbar.update()
+
+    if n_failed:
+        print(f"{n_failed} captures failed")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+from typing import Iterable, Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+
+from fingerprint_matcher import (
+    ANGLE_TOLERANCE,
+    DISTANCE_TOLERANCE,
+    MINUTIA_TYPES,
+    Minutia,
+    minutiae_arrays,
+)
+
+PADDING_TYPE = 0xFF
+
+
+class Gallery:
+    """
+    All enrolled templates in one padded struct-of-arrays.
+
+    Row t of `x`, `y`, `angle` and `type` holds the minutiae of template t,
+    padded up to the largest template with `PADDING_TYPE`; `counts[t]` is
+    the number of real minutiae and `owner[t]` indexes into `names`.
+    """
+
+    def __init__(
+        self,
+        names: list[str],
+        owner: NDArray[np.int32],
+        counts: NDArray[np.int32],
+        x: NDArray[np.int16],
+        y: NDArray[np.int16],
+        angle: NDArray[np.float32],
+        type: NDArray[np.uint8],
+    ):
+        self.names = names
+        self.owner = owner
+        self.counts = counts
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.type = type
+
+    @classmethod
+    def from_templates(
+        cls, templates: Iterable[tuple[str, Sequence[Minutia]]]
+    ) -> "Gallery":
+        templates = list(templates)
+        names = list(dict.fromkeys(name for name, _ in templates))
+        owner_ids = {name: i for i, name in enumerate(names)}
+
+        n_templates = len(templates)
+        width = max((len(minutiae) for _, minutiae in templates), default=0)
+        counts = np.zeros(n_templates, dtype=np.int32)
+        owner = np.zeros(n_templates, dtype=np.int32)
+        x = np.zeros((n_templates, width), dtype=np.int16)
+        y = np.zeros((n_templates, width), dtype=np.int16)
+        angle = np.zeros((n_templates, width), dtype=np.float32)
+        type = np.full((n_templates, width), PADDING_TYPE, dtype=np.uint8)
+
+        for t, (name, minutiae) in enumerate(templates):
+            n = len(minutiae)
+            counts[t] = n
+            owner[t] = owner_ids[name]
+            if n:
+                x[t, :n], y[t, :n], angle[t, :n], type[t, :n] = (
+                    minutiae_arrays(minutiae)
+                )
+
+        return cls(names, owner, counts, x, y, angle, type)
+
+    @classmethod
+    def from_packed(
+        cls,
+        names: list[str],
+        data: NDArray,
+        offsets: NDArray[np.int64],
+    ) -> "Gallery":
+        """
+        Templates stored back to back in one `MINUTIA_DTYPE` array:
+        template t is `data[offsets[t]:offsets[t + 1]]`
+        """
+        offsets = np.asarray(offsets, dtype=np.int64) - offsets[0]
+        counts = np.diff(offsets).astype(np.int32)
+        n_templates = len(counts)
+        width = int(counts.max(initial=0))
+        rows = np.repeat(np.arange(n_templates), counts)
+        cols = np.arange(len(rows)) - np.repeat(offsets[:-1], counts)
+        data = data[: offsets[-1]]
+
+        x = np.zeros((n_templates, width), dtype=np.int16)
+        y = np.zeros((n_templates, width), dtype=np.int16)
+        angle = np.zeros((n_templates, width), dtype=np.float32)
+        type = np.full((n_templates, width), PADDING_TYPE, dtype=np.uint8)
+        x[rows, cols] = data["x"]
+        y[rows, cols] = data["y"]
+        angle[rows, cols] = data["angle"]
+        type[rows, cols] = data["type"]
+
+        owner = np.arange(n_templates, dtype=np.int32)
+        return cls(names, owner, counts, x, y, angle, type)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def score(
+        self, probe: Sequence[Minutia], chunk_size: int = 1024
+    ) -> NDArray[np.int32]:
+        """
+        Count matched minutiae between the probe and every template.
+
+        For each template the result equals
+        `match_minutiae(template, probe)`: template minutiae are visited in
+        order and take the first compatible, still unmatched probe
+        minutia. Templates are processed `chunk_size` at a time, so memory
+        stays bounded by about chunk_size * width * len(probe) * 4 bytes.
+        """
+        scores = np.zeros(len(self), dtype=np.int32)
+        if len(probe) == 0 or len(self) == 0:
+            return scores
+
+        px, py, pa, pt = minutiae_arrays(probe)
+        px = px.astype(np.int16)
+        py = py.astype(np.int16)
+
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            width = int(self.counts[start:stop].max(initial=0))
+            if width == 0:
+                continue
+
+            compatible = self._compatibility(
+                slice(start, stop), width, px, py, pa, pt
+            )
+
+            rows = np.arange(stop - start)
+            available = np.ones((stop - start, len(probe)), dtype=bool)
+            chunk_scores = scores[start:stop]
+            for j in np.flatnonzero(compatible.any(axis=(0, 2))):
+                candidates = compatible[:, j, :] & available
+                k = np.argmax(candidates, axis=1)
+                hit = candidates[rows, k]
+                available[rows[hit], k[hit]] = False
+                chunk_scores += hit
+
+        return scores
+
+    def _compatibility(
+        self,
+        templates: slice,
+        width: int,
+        px: NDArray[np.int16],
+        py: NDArray[np.int16],
+        pa: NDArray[np.float64],
+        pt: NDArray[np.uint8],
+    ) -> NDArray[np.bool_]:
+        """
+        `Minutia.__eq__` between every template minutia of the slice and
+        every probe minutia, as a (templates, width, probe) boolean array.
+        """
+        # Cheap prefilter on the whole block, the exact distance and angle
+        # rules only run on the few pairs that survive it
+        t = self.type[templates, :width, None]
+        dx = self.x[templates, :width, None] - px
+        dy = self.y[templates, :width, None] - py
+        near = (
+            (np.abs(dx) <= DISTANCE_TOLERANCE)
+            & (np.abs(dy) <= DISTANCE_TOLERANCE)
+            & (t == pt)
+        )
+        c, j, k = np.nonzero(near)
+
+        rows = c + templates.start
+        dx = dx[c, j, k].astype(np.float64)
+        dy = dy[c, j, k].astype(np.float64)
+        da = np.abs(
+            (self.angle[rows, j].astype(np.float64) - pa[k] + 180) % 360 - 180
+        )
+        keep = (np.sqrt(dx * dx + dy * dy) <= DISTANCE_TOLERANCE) & (
+            (pt[k] != MINUTIA_TYPES.index("termination"))
+            | (da <= ANGLE_TOLERANCE)
+        )
+
+        compatible = np.zeros(near.shape, dtype=bool)
+        compatible[c[keep], j[keep], k[keep]] = True
+        return compatible
+
+    def identify(
+        self,
+        probe: Sequence[Minutia],
+        top_k: int = 5,
+        chunk_size: int = 1024,
+    ) -> list[tuple[str, int]]:
+        """Return the `top_k` best (name, score) candidates for the probe"""
+        scores = self.score(probe, chunk_size)
+        top_k = min(top_k, len(scores))
+        if top_k == 0:
+            return []
+
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind="stable")]
+        return [(self.names[self.owner[t]], int(scores[t])) for t in best]
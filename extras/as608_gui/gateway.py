@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import math
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from as608_client import AS608Client
+from as608_protocol import BAUD_RATES, ProtocolError, find_arduino_ports
+from fingerprint_matcher import Fingerprint, MinutiaSet, set_enhance_workers
+from image_codec import unpack_nibbles
+from image_quality import QualityReport, assess_quality
+from mapped_gallery import ShardedGallery, write_gallery
+from template_cache import shared_cache
+from template_index import TemplateIndex
+
+MIN_N_MATCHES = 12
+
+
+def extract_minutiae(
+    image_bytes: bytes, cache_dir: Optional[Path] = None
+) -> tuple[QualityReport, Optional[MinutiaSet]]:
+    """
+    Runs in the worker pool: decode a capture and extract its minutiae,
+    unless it fails the quality gate
+    """
+    image = unpack_nibbles(image_bytes)
+    report = assess_quality(image)
+    if not report.ok:
+        return report, None
+    if cache_dir is not None:
+        fp = shared_cache(cache_dir).fingerprint(image, features_only=True)
+    else:
+        fp = Fingerprint(image, features_only=True)
+    return report, fp.minutiae
+
+
+class Gateway:
+    """
+    Serve every AS608 reader attached to this host from one process.
+
+    Each device gets its own session that captures images and a bounded
+    queue in front of the matcher: once `queue_size` captures are waiting,
+    that reader stops asking for new fingers until the matcher catches up.
+    A session reconnects after a serial or protocol error, and after
+    `idle_timeout` seconds without a word from a reader waiting for a
+    finger, which means its sketch or link is gone.
+    Feature extraction runs in one shared process pool; identification uses
+    a single in-memory template index, loaded once for all devices. With
+    `shards`, the index is written to a memory-mapped gallery file that
+    that many processes score in parallel.
+    """
+
+    def __init__(
+        self,
+        db_dir: Path,
+        executor: Executor,
+        baud_rate: int = BAUD_RATES[0],
+        queue_size: int = 2,
+        refresh_interval: float = 5.0,
+        cache_dir: Optional[Path] = None,
+        shards: int = 0,
+        idle_timeout: float = 5.0,
+    ):
+        self.template_index = TemplateIndex(db_dir)
+        self.gallery_path = db_dir / "gallery.bin"
+        self.sharded_gallery = None
+        if shards:
+            self.sharded_gallery = ShardedGallery(self.gallery_path, shards)
+        self._gallery_generation: Optional[int] = None
+        self.cache_dir = cache_dir
+        # Refreshing and identifying both touch the index, serialize them
+        self.index_executor = ThreadPoolExecutor(max_workers=1)
+        self.executor = executor
+        self.baud_rate = baud_rate
+        self.queue_size = queue_size
+        self.refresh_interval = refresh_interval
+        self.idle_timeout = idle_timeout
+
+    async def run(self, port_names: list[str]) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.index_executor, self.refresh)
+        print(f"Loaded {len(self.template_index)} templates")
+
+        tasks = [asyncio.create_task(self._refresh_index())]
+        for port_name in port_names:
+            queue: asyncio.Queue[bytes] = asyncio.Queue(self.queue_size)
+            tasks.append(asyncio.create_task(self._capture(port_name, queue)))
+            tasks.append(asyncio.create_task(self._match(port_name, queue)))
+
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _refresh_index(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await loop.run_in_executor(self.index_executor, self.refresh)
+
+    def refresh(self) -> None:
+        self.template_index.refresh()
+        generation = self.template_index.generation
+        if (
+            self.sharded_gallery is not None
+            and self._gallery_generation != generation
+        ):
+            templates = [
+                (entry.name, entry.minutiae) for entry in self.template_index
+            ]
+            write_gallery(self.gallery_path, templates)
+            self._gallery_generation = generation
+
+    def close(self) -> None:
+        self.index_executor.shutdown()
+        if self.sharded_gallery is not None:
+            self.sharded_gallery.close()
+
+    async def _capture(self, port_name: str, queue: asyncio.Queue) -> None:
+        while True:
+            try:
+                async with AS608Client(port_name) as client:
+                    if self.baud_rate != BAUD_RATES[0]:
+                        await client.set_baud_rate(self.baud_rate)
+                    print(f"{port_name}: ready")
+                    # A finger left on the reader is only captured once
+                    wait_for_lift = False
+                    while True:
+                        await client.get_image(
+                            timeout=math.inf,
+                            wait_for_lift=wait_for_lift,
+                            idle_timeout=self.idle_timeout,
+                        )
+                        await queue.put(await client.up_image())
+                        wait_for_lift = True
+            except (OSError, ProtocolError, asyncio.TimeoutError) as e:
+                print(f"{port_name}: {e!r}, reconnecting")
+                await asyncio.sleep(1)
+
+    async def _match(self, port_name: str, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            image_bytes = await queue.get()
+            try:
+                report, minutiae = await loop.run_in_executor(
+                    self.executor, extract_minutiae, image_bytes, self.cache_dir
+                )
+                if minutiae is None:
+                    print(
+                        f"{port_name}: poor image quality "
+                        f"({', '.join(report.reasons)}), try again"
+                    )
+                    continue
+                candidates = await loop.run_in_executor(
+                    self.index_executor, self.identify, minutiae
+                )
+            except Exception as e:
+                print(f"{port_name}: failed to match ({e!r})")
+                continue
+            finally:
+                queue.task_done()
+
+            self.on_result(port_name, candidates)
+
+    def identify(self, minutiae: MinutiaSet) -> list[tuple[str, int]]:
+        if self.sharded_gallery is not None:
+            return self.sharded_gallery.identify(minutiae, top_k=1)
+        return self.template_index.identify(minutiae, top_k=1)
+
+    def on_result(
+        self, port_name: str, candidates: list[tuple[str, int]]
+    ) -> Optional[str]:
+        if candidates and candidates[0][1] >= MIN_N_MATCHES:
+            name, n_matches = candidates[0]
+            print(f"{port_name}: Hello, {name}! ({n_matches} matches)")
+            return name
+
+        print(f"{port_name}: Fingerprint not matched")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Identify fingers on every connected AS608 reader"
+    )
+    parser.add_argument(
+        "ports",
+        nargs="*",
+        help="serial ports to serve (default: every Arduino found)",
+    )
+    parser.add_argument(
+        "--db", type=Path, default=Path(__file__).parent / "db"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="number of processes"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=2,
+        help="captures buffered per reader before it stops capturing",
+    )
+    parser.add_argument(
+        "--baud", type=int, choices=BAUD_RATES, default=BAUD_RATES[0]
+    )
+    parser.add_argument(
+        "--cache",
+        type=Path,
+        help="template cache directory shared by the worker processes",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="processes matching a memory-mapped copy of the templates",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=5.0,
+        help="seconds of silence from a reader before reconnecting to it",
+    )
+    args = parser.parse_args()
+
+    port_names = args.ports or [port.device for port in find_arduino_ports()]
+    if not port_names:
+        print("Arduino not found")
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=args.jobs,
+        initializer=set_enhance_workers,
+        initargs=(1,),
+    ) as executor:
+        gateway = Gateway(
+            args.db,
+            executor,
+            args.baud,
+            args.queue_size,
+            cache_dir=args.cache,
+            shards=args.shards,
+            idle_timeout=args.idle_timeout,
+        )
+        try:
+            asyncio.run(gateway.run(port_names))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import numpy as np
+from numpy.typing import NDArray
+
+# Every byte of an UpImage payload packs two 4-bit pixels, high nibble first.
+# Row ``b`` holds the two 8-bit pixels of byte ``b``, scaled by 17 (= 255 / 15)
+NIBBLE_LUT: NDArray[np.uint8] = np.array(
+    [[(b >> 4) * 17, (b & 0x0F) * 17] for b in range(256)], dtype=np.uint8
+)
+
+
+def unpack_nibbles(
+    image_bytes,
+    dimension: tuple[int, int] = (256, 288),
+    out: NDArray[np.uint8] | None = None,
+) -> NDArray[np.uint8]:
+    """
+    Decode a packed 4-bit image into a (height, width) uint8 array.
+
+    `image_bytes` may be any buffer-protocol object (bytes, bytearray,
+    memoryview, ndarray...); it is viewed in place, never copied. If `out` is
+    given, the pixels are written into it instead of a new array.
+    """
+    width, height = dimension
+    packed = np.frombuffer(image_bytes, dtype=np.uint8)
+    if packed.size * 2 != width * height:
+        raise ValueError(
+            f"Expected {width * height // 2} image bytes, got {packed.size}"
+        )
+
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+    elif (
+        out.shape != (height, width)
+        or out.dtype != np.uint8
+        or not out.flags.c_contiguous
+    ):
+        raise ValueError(
+            f"out must be a contiguous ({height}, {width}) uint8 array"
+        )
+
+    unpack_nibbles_into(packed, out)
+    return out
+
+
+def unpack_nibbles_into(
+    image_bytes, out: NDArray[np.uint8], byte_offset: int = 0
+) -> None:
+    """
+    Decode a slice of a packed image in place: `image_bytes` are the packed
+    bytes starting at `byte_offset`, written into the matching pixels of
+    the contiguous array `out`.
+    """
+    packed = np.frombuffer(image_bytes, dtype=np.uint8)
+    pixels = out.reshape(-1)
+    start = 2 * byte_offset
+    stop = start + 2 * packed.size
+    if stop > pixels.size:
+        raise ValueError("Chunk exceeds the image")
+    np.take(NIBBLE_LUT, packed, axis=0, out=pixels[start:stop].reshape(-1, 2))
+
+
+def pack_nibbles(img: NDArray[np.uint8]) -> bytes:
+    """
+    Encode an image of 4-bit pixels (multiples of 17, as `unpack_nibbles`
+    returns them) back into the packed UpImage payload.
+    """
+    pixels = np.asarray(img, dtype=np.uint8).reshape(-1)
+    if pixels.size % 2 or np.any(pixels % 17):
+        raise ValueError("Image is not made of 4-bit pixels")
+    nibbles = pixels // 17
+    return ((nibbles[0::2] << 4) | nibbles[1::2]).tobytes()
+
+
+# Compressed UpImage frames (DeviceState.CompressedData) carry one sensor
+# packet as the difference of every pixel to the previous one (to 0 for the
+# first), modulo 16: the packet's length in bytes, a 2-bit code per pixel
+# (first pixel in the top bits), then the escaped differences as nibbles
+# (high first, zero padded). Sensor noise keeps most differences within ±1.
+MAX_DELTA_PAYLOAD = 128
+DELTA_ESCAPE = 2
+# Difference modulo 16 -> 2-bit code, anything else is escaped
+DELTA_CODES = {0: 0, 1: 1, 15: 3}
+# 2-bit code -> difference, an escape's difference comes from its nibble
+CODE_DELTAS = np.array([0, 1, 0, 15], dtype=np.uint8)
+CODE_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+
+def delta_encode(payload: bytes) -> bytes:
+    """
+    Compress one UpImage payload as Control.ino does for
+    UpImageCompressed, in plain Python to test the host without a sensor
+    """
+    if len(payload) > MAX_DELTA_PAYLOAD:
+        raise ValueError(f"Payload longer than {MAX_DELTA_PAYLOAD} bytes")
+
+    codes = bytearray((2 * len(payload) + 3) // 4)
+    escapes = []
+    previous = 0
+    for i in range(2 * len(payload)):
+        byte = payload[i // 2]
+        pixel = byte & 0x0F if i % 2 else byte >> 4
+        delta = (pixel - previous) & 0x0F
+        previous = pixel
+        code = DELTA_CODES.get(delta, DELTA_ESCAPE)
+        if code == DELTA_ESCAPE:
+            escapes.append(delta)
+        codes[i // 4] |= code << (6 - 2 * (i % 4))
+
+    if len(escapes) % 2:
+        escapes.append(0)
+    packed_escapes = bytes(
+        (escapes[i] << 4) | escapes[i + 1] for i in range(0, len(escapes), 2)
+    )
+    return bytes([len(payload)]) + bytes(codes) + packed_escapes
+
+
+def delta_decode(frame, out=None) -> NDArray[np.uint8]:
+    """
+    Decode a compressed frame back into its packed UpImage payload, written
+    into the buffer `out` (of the payload's length) if given
+    """
+    data = np.frombuffer(frame, dtype=np.uint8)
+    if data.size == 0:
+        raise ValueError("Empty compressed frame")
+    n_bytes = int(data[0])
+    n_pixels = 2 * n_bytes
+    n_code_bytes = (n_pixels + 3) // 4
+    if data.size < 1 + n_code_bytes:
+        raise ValueError("Truncated compressed frame")
+
+    codes = data[1 : 1 + n_code_bytes, None] >> CODE_SHIFTS
+    codes = (codes & 0x03).reshape(-1)[:n_pixels]
+    deltas = CODE_DELTAS[codes]
+    escaped = codes == DELTA_ESCAPE
+    n_escapes = int(np.count_nonzero(escaped))
+    escapes = data[1 + n_code_bytes :]
+    if escapes.size != (n_escapes + 1) // 2:
+        raise ValueError("Compressed frame size mismatch")
+    nibbles = np.column_stack([escapes >> 4, escapes & 0x0F]).reshape(-1)
+    deltas[escaped] = nibbles[:n_escapes]
+    pixels = (np.cumsum(deltas, dtype=np.uint16) & 0x0F).astype(np.uint8)
+
+    if out is None:
+        out = np.empty(n_bytes, dtype=np.uint8)
+    else:
+        out = np.frombuffer(out, dtype=np.uint8)
+        if out.size != n_bytes:
+            raise ValueError(f"out must hold {n_bytes} bytes")
+    np.bitwise_or(pixels[0::2] << 4, pixels[1::2], out=out)
+    return out
@@ -0,0 +1,117 @@
+import time
+from dataclasses import dataclass, field
+
+import cv2
+import numpy as np
+from cv2.typing import MatLike
+from numpy.typing import NDArray
+
+BLOCK_SIZE = 16
+# A block is foreground when its gray level standard deviation exceeds this
+FOREGROUND_STD = 10.0
+
+# Images below any of these are rejected before enhancement
+MIN_COVERAGE = 0.35
+MIN_CONTRAST = 18.0
+MIN_COHERENCE = 0.35
+
+
+@dataclass
+class QualityReport:
+    """
+    `coverage` is the fraction of foreground blocks, `contrast` the gray
+    level standard deviation over them and `coherence` their mean ridge
+    orientation coherence (0 for isotropic noise, 1 for parallel ridges).
+    """
+
+    coverage: float
+    contrast: float
+    coherence: float
+    elapsed: float
+    reasons: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.reasons
+
+    def __str__(self):
+        return (
+            f"coverage {self.coverage:.2f}, contrast {self.contrast:.1f}, "
+            f"coherence {self.coherence:.2f}"
+        )
+
+
+def block_sums(img: NDArray, block_size: int = BLOCK_SIZE) -> NDArray:
+    """Sum of every non-overlapping block, trailing pixels are ignored"""
+    rows = img.shape[0] // block_size
+    cols = img.shape[1] // block_size
+    return (
+        img[: rows * block_size, : cols * block_size]
+        .reshape(rows, block_size, cols, block_size)
+        .sum(axis=(1, 3))
+    )
+
+
+def block_variance(img: NDArray, block_size: int = BLOCK_SIZE) -> NDArray:
+    """Gray level variance of every non-overlapping block"""
+    img = np.asarray(img, dtype=np.float32)
+    n = block_size * block_size
+    mean = block_sums(img, block_size) / n
+    return np.maximum(block_sums(img * img, block_size) / n - mean * mean, 0)
+
+
+def assess_quality(
+    img: MatLike,
+    min_coverage: float = MIN_COVERAGE,
+    min_contrast: float = MIN_CONTRAST,
+    min_coherence: float = MIN_COHERENCE,
+) -> QualityReport:
+    """
+    Score a raw capture in a few block-wise array operations, cheap next
+    to `enhance_Fingerprint`, so that smudged, partial or empty captures
+    can be retaken instead of being enhanced and skeletonized.
+    """
+    start = time.perf_counter()
+    img = np.asarray(img, dtype=np.float32)
+
+    var = block_variance(img)
+    foreground = var > FOREGROUND_STD**2
+    coverage = float(foreground.mean())
+
+    contrast = coherence = 0.0
+    if foreground.any():
+        contrast = float(np.sqrt(var[foreground].mean()))
+
+        gx = cv2.Sobel(img, cv2.CV_32F, 1, 0, ksize=3)
+        gy = cv2.Sobel(img, cv2.CV_32F, 0, 1, ksize=3)
+        gxx = block_sums(gx * gx)[foreground]
+        gyy = block_sums(gy * gy)[foreground]
+        gxy = block_sums(gx * gy)[foreground]
+        energy = gxx + gyy
+        anisotropy = np.sqrt((gxx - gyy) ** 2 + 4 * gxy * gxy)
+        coherence = float(
+            np.mean(
+                np.divide(
+                    anisotropy,
+                    energy,
+                    out=np.zeros_like(energy),
+                    where=energy > 0,
+                )
+            )
+        )
+
+    reasons = []
+    if coverage < min_coverage:
+        reasons.append(f"coverage {coverage:.2f} < {min_coverage:.2f}")
+    if contrast < min_contrast:
+        reasons.append(f"contrast {contrast:.1f} < {min_contrast:.1f}")
+    if coherence < min_coherence:
+        reasons.append(f"coherence {coherence:.2f} < {min_coherence:.2f}")
+
+    return QualityReport(
+        coverage=coverage,
+        contrast=contrast,
+        coherence=coherence,
+        elapsed=time.perf_counter() - start,
+        reasons=reasons,
+    )
@@ -1,24 +1,25 @@
-from serial.tools.list_ports import comports
+import argparse
 
 from as608_controller import AS608Controller
+from as608_protocol import BAUD_RATES, find_arduino_port
 
 
-def find_arduino_port():
-    com_ports = sorted(comports())
-    arduino_port = next(
-        filter(lambda port: "Arduino" in port.description, com_ports), None
+def main():
+    parser = argparse.ArgumentParser(description="AS608 command line client")
+    parser.add_argument(
+        "--baud",
+        type=int,
+        choices=BAUD_RATES,
+        default=BAUD_RATES[0],
+        help="host link rate to negotiate with the sketch",
     )
+    args = parser.parse_args()
 
-    if arduino_port is None:
-        raise ValueError("Arduino not found")
-
-    return arduino_port
-
-
-def main():
     try:
         arduino_port = find_arduino_port()
-        with AS608Controller(port_name=arduino_port.device) as controller:
+        with AS608Controller(
+            port_name=arduino_port.device, baud_rate=args.baud
+        ) as controller:
             controller.run()
     except ValueError as e:
         print(e)
@@ -0,0 +1,288 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+from itertools import pairwise
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+
+from fingerprint_matcher import MINUTIA_DTYPE, Minutia, MinutiaSet
+from gallery import Gallery
+
+GALLERY_MAGIC = b"AS608GAL"
+GALLERY_VERSION = 1
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("version", "<u4"),
+        ("n_templates", "<u8"),
+        ("n_minutiae", "<u8"),
+        ("names_size", "<u8"),
+    ]
+)
+# Minutiae as stored in the file, whatever the host's byte order
+FILE_DTYPE = MINUTIA_DTYPE.newbyteorder("<")
+# Every section starts on a multiple of this many bytes
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def _layout(n_templates: int, n_minutiae: int) -> tuple[int, int, int]:
+    """Byte offsets of the offsets table, the minutiae and the names"""
+    offsets_start = _align(HEADER_DTYPE.itemsize)
+    minutiae_start = _align(offsets_start + 8 * (n_templates + 1))
+    names_start = minutiae_start + FILE_DTYPE.itemsize * n_minutiae
+    return offsets_start, minutiae_start, names_start
+
+
+def write_gallery(
+    path: Path, templates: Iterable[tuple[str, Sequence[Minutia]]]
+) -> None:
+    """
+    Write templates as a gallery file: a header, the offsets table
+    (template t is minutiae `offsets[t]` to `offsets[t + 1]`), every
+    minutia back to back, and the names as a JSON list. The file is
+    replaced atomically, readers of the previous one are not disturbed.
+    """
+    names = []
+    datas = []
+    for name, minutiae in templates:
+        names.append(name)
+        datas.append(MinutiaSet.from_minutiae(minutiae).data)
+
+    offsets = np.zeros(len(datas) + 1, dtype="<i8")
+    np.cumsum([len(data) for data in datas], out=offsets[1:])
+    minutiae = np.concatenate(
+        [np.empty(0, dtype=MINUTIA_DTYPE), *datas]
+    ).astype(FILE_DTYPE)
+    names_bytes = json.dumps(names).encode()
+    header = np.array(
+        [
+            (
+                GALLERY_MAGIC,
+                GALLERY_VERSION,
+                len(names),
+                len(minutiae),
+                len(names_bytes),
+            )
+        ],
+        dtype=HEADER_DTYPE,
+    )
+    offsets_start, minutiae_start, names_start = _layout(
+        len(names), len(minutiae)
+    )
+
+    tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header.tobytes())
+        f.seek(offsets_start)
+        f.write(offsets.tobytes())
+        f.seek(minutiae_start)
+        f.write(minutiae.tobytes())
+        f.seek(names_start)
+        f.write(names_bytes)
+    tmp_path.replace(path)
+
+
+class MappedGallery:
+    """
+    Read-only, memory-mapped view of a gallery file.
+
+    Nothing is copied when opening: the offsets and minutiae are views of
+    the mapping, so every process that opens the same file shares its
+    pages through the page cache. Templates are unpacked into a `Gallery`
+    a chunk at a time while scoring; the names are only read when needed.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if (
+            len(header) == 0
+            or header["magic"][0] != GALLERY_MAGIC
+            or header["version"][0] != GALLERY_VERSION
+        ):
+            raise ValueError(
+                f"Not a version {GALLERY_VERSION} gallery: {path}"
+            )
+        n_templates = int(header["n_templates"][0])
+        n_minutiae = int(header["n_minutiae"][0])
+        self._names_size = int(header["names_size"][0])
+
+        self._map = np.memmap(path, dtype=np.uint8, mode="r")
+        offsets_start, minutiae_start, self._names_start = _layout(
+            n_templates, n_minutiae
+        )
+        if len(self._map) < self._names_start + self._names_size:
+            raise ValueError(f"Truncated gallery: {path}")
+        self.offsets = self._map[
+            offsets_start : offsets_start + 8 * (n_templates + 1)
+        ].view("<i8")
+        self.minutiae = self._map[minutiae_start : self._names_start].view(
+            FILE_DTYPE
+        )
+
+    @cached_property
+    def names(self) -> list[str]:
+        start = self._names_start
+        return json.loads(bytes(self._map[start : start + self._names_size]))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def template(self, t: int) -> MinutiaSet:
+        return MinutiaSet(self.minutiae[self.offsets[t] : self.offsets[t + 1]])
+
+    def gallery(self, start: int, stop: int) -> Gallery:
+        """Templates `start` to `stop` unpacked for scoring"""
+        offsets = self.offsets[start : stop + 1]
+        data = self.minutiae[offsets[0] : offsets[-1]]
+        return Gallery.from_packed(list(range(start, stop)), data, offsets)
+
+    def shards(self, n_shards: int) -> list[tuple[int, int]]:
+        """Split the templates into `n_shards` ranges of similar size"""
+        bounds = np.searchsorted(
+            self.offsets, np.linspace(0, self.offsets[-1], n_shards + 1)
+        )
+        bounds[0], bounds[-1] = 0, len(self)
+        return [(int(a), int(b)) for a, b in pairwise(bounds) if b > a]
+
+    def top_k(
+        self,
+        probe: Sequence[Minutia],
+        start: int = 0,
+        stop: Optional[int] = None,
+        top_k: int = 5,
+        chunk_size: int = 1024,
+    ) -> list[tuple[int, int]]:
+        """
+        Best (template id, score) of templates `start` to `stop`, unpacking
+        `chunk_size` templates at a time
+        """
+        stop = len(self) if stop is None else stop
+        best: list[tuple[int, int]] = []
+        for chunk_start in range(start, stop, chunk_size):
+            gallery = self.gallery(
+                chunk_start, min(chunk_start + chunk_size, stop)
+            )
+            best += gallery.identify(probe, top_k, chunk_size)
+            best = sorted(best, key=lambda c: (-c[1], c[0]))[:top_k]
+        return best
+
+    def identify(
+        self, probe: Sequence[Minutia], top_k: int = 5
+    ) -> list[tuple[str, int]]:
+        """Return the `top_k` best (name, score) candidates for the probe"""
+        return [
+            (self.names[t], score)
+            for t, score in self.top_k(probe, top_k=top_k)
+        ]
+
+
+# The gallery each pool worker has mapped, and the file version it maps
+_worker_gallery: Optional[MappedGallery] = None
+_worker_signature: Optional[tuple] = None
+
+
+def worker_context() -> multiprocessing.context.BaseContext:
+    """
+    Start workers from a fresh process rather than forking the caller, so
+    they do not inherit, and end up copying, its memory
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def file_signature(path: Path) -> tuple[int, int, int]:
+    """Changes whenever `write_gallery` replaces the file"""
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def score_shard(
+    path: Path,
+    signature: tuple,
+    probe: NDArray,
+    start: int,
+    stop: int,
+    top_k: int,
+) -> list[tuple[int, int]]:
+    """
+    Runs in the pool: the top-k of one shard, mapping the gallery file on
+    the first call and again once it has been replaced
+    """
+    global _worker_gallery, _worker_signature
+    if _worker_gallery is None or _worker_signature != (path, signature):
+        _worker_gallery = MappedGallery(path)
+        _worker_signature = (path, signature)
+    return _worker_gallery.top_k(MinutiaSet(probe), start, stop, top_k)
+
+
+class ShardedGallery:
+    """
+    1:N identification against a gallery file, sharded across `workers`
+    processes.
+
+    Each worker maps the file itself, so templates are neither copied
+    into nor pickled to the workers, and their memory does not grow with
+    the gallery. A query sends the probe to every shard and only gets its
+    top-k back. Rewriting the file with `write_gallery` is picked up by
+    the next query.
+    """
+
+    def __init__(self, path: Path, workers: Optional[int] = None):
+        self.path = path
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=worker_context()
+        )
+        self._gallery: Optional[MappedGallery] = None
+        self._signature: Optional[tuple] = None
+
+    def __enter__(self) -> "ShardedGallery":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def _open(self) -> tuple[MappedGallery, tuple]:
+        signature = file_signature(self.path)
+        if self._gallery is None or self._signature != signature:
+            self._gallery = MappedGallery(self.path)
+            self._signature = signature
+        return self._gallery, signature
+
+    def __len__(self) -> int:
+        return len(self._open()[0])
+
+    def identify(
+        self, probe: Sequence[Minutia], top_k: int = 5
+    ) -> list[tuple[str, int]]:
+        """Return the `top_k` best (name, score) candidates for the probe"""
+        gallery, signature = self._open()
+        probe = MinutiaSet.from_minutiae(probe).data
+        futures = [
+            self.executor.submit(
+                score_shard, self.path, signature, probe, start, stop, top_k
+            )
+            for start, stop in gallery.shards(self.workers)
+        ]
+        best = sorted(
+            (c for future in futures for c in future.result()),
+            key=lambda c: (-c[1], c[0]),
+        )
+        return [(gallery.names[t], score) for t, score in best[:top_k]]
@@ -0,0 +1,222 @@
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """The last `window` samples of a series, for rolling quantiles"""
+
+    def __init__(self, window: int):
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float) -> None:
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self) -> dict[float, float]:
+        samples = np.fromiter(list(self.samples), dtype=np.float64)
+        if len(samples) == 0:
+            return {q: float("nan") for q in QUANTILES}
+        return dict(zip(QUANTILES, np.quantile(samples, QUANTILES).tolist()))
+
+
+class NullStage:
+    """What a disabled profiler hands out: does nothing, as fast as it can"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return None
+
+    def record(self) -> None:
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+    """Times the `with` block it wraps as one sample of `name`"""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+
+class StageTotal:
+    """
+    Sums every `with` block it wraps; `record()` stores the total as one
+    sample, for work spread over many small calls such as a frame decode.
+    """
+
+    __slots__ = ("profiler", "name", "start", "elapsed")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed += time.perf_counter() - self.start
+
+    def record(self) -> None:
+        self.profiler.record(self.name, self.elapsed)
+
+
+class Profiler:
+    """
+    Per-stage latency of the capture and match pipeline.
+
+    Stage durations (seconds) and other measurements such as throughput are
+    kept as rolling histograms of the last `window` samples; counters count
+    events such as protocol errors. While disabled, `stage` and `total`
+    return a shared no-op context manager and `record`, `observe` and
+    `count` return immediately.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = 1024):
+        self.enabled = enabled
+        self.window = window
+        self.stages: dict[str, RollingHistogram] = {}
+        self.values: dict[str, RollingHistogram] = {}
+        self.counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> Stage | NullStage:
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def total(self, name: str) -> StageTotal | NullStage:
+        if not self.enabled:
+            return NULL_STAGE
+        return StageTotal(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        if self.enabled:
+            self._add(self.stages, name, seconds)
+
+    def observe(self, name: str, value: float) -> None:
+        if self.enabled:
+            self._add(self.values, name, value)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def _add(
+        self, histograms: dict[str, RollingHistogram], name: str, value: float
+    ) -> None:
+        with self._lock:
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = RollingHistogram(self.window)
+            histogram.add(value)
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stages.clear()
+            self.values.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> dict:
+        def summarize(histograms: dict[str, RollingHistogram]) -> dict:
+            return {
+                name: {
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    **{
+                        f"p{round(q * 100)}": value
+                        for q, value in histogram.quantiles().items()
+                    },
+                }
+                for name, histogram in histograms.items()
+            }
+
+        with self._lock:
+            return {
+                "stages": summarize(self.stages),
+                "values": summarize(self.values),
+                "counters": dict(self.counters),
+            }
+
+    def summary(self, stages: Optional[list[str]] = None) -> str:
+        """One line of p50/p95 milliseconds per stage, for a status bar"""
+        snapshot = self.snapshot()["stages"]
+        return "  ".join(
+            f"{name} {stats['p50'] * 1e3:.0f}/{stats['p95'] * 1e3:.0f}ms"
+            for name, stats in snapshot.items()
+            if stages is None or name in stages
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = "as608") -> str:
+        snapshot = self.snapshot()
+        lines = []
+
+        def add_summary(metric: str, label: Optional[str], stats: dict):
+            labels = f"{label}," if label else ""
+            for q in QUANTILES:
+                lines.append(
+                    f'{metric}{{{labels}quantile="{q}"}} '
+                    f"{stats[f'p{round(q * 100)}']}"
+                )
+            suffix = f"{{{label}}}" if label else ""
+            lines.append(f"{metric}_sum{suffix} {stats['sum']}")
+            lines.append(f"{metric}_count{suffix} {stats['count']}")
+
+        if snapshot["stages"]:
+            metric = f"{prefix}_stage_seconds"
+            lines.append(f"# TYPE {metric} summary")
+            for name, stats in snapshot["stages"].items():
+                add_summary(metric, f'stage="{name}"', stats)
+
+        for name, stats in snapshot["values"].items():
+            metric = f"{prefix}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+            add_summary(metric, None, stats)
+
+        for name, value in snapshot["counters"].items():
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: Path) -> None:
+        """Write the snapshot as Prometheus text for .prom, else JSON"""
+        if path.suffix == ".prom":
+            path.write_text(self.to_prometheus())
+        else:
+            path.write_text(self.to_json())
+
+
+# Shared by every module of the pipeline; enable with `profiler.enabled`
+profiler = Profiler()
@@ -0,0 +1,219 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from cv2.typing import MatLike
+from numpy.typing import NDArray
+
+from fingerprint_matcher import (
+    MINUTIA_DTYPE,
+    PIPELINE_VERSION,
+    Fingerprint,
+    MinutiaSet,
+)
+from image_codec import pack_nibbles
+
+# Intermediate images worth keeping, result_img is cheap to redraw
+CACHED_IMAGES = ("enhanced_img", "skeleton_img", "aligned_img")
+
+
+@dataclass
+class CacheEntry:
+    minutiae: MinutiaSet
+    images: dict[str, NDArray[np.uint8]] = field(default_factory=dict)
+
+
+def image_key(image: bytes | MatLike) -> str:
+    """
+    Hash of a capture's packed 4-bit pixels: UpImage bytes and the image
+    decoded from them, or saved to a BMP, share the same key.
+    """
+    if not isinstance(image, (bytes, bytearray, memoryview)):
+        try:
+            image = pack_nibbles(image)
+        except ValueError:
+            # Not a sensor image, hash its pixels and shape instead
+            image = np.ascontiguousarray(image)
+            image = repr(image.shape).encode() + image.tobytes()
+    return hashlib.blake2b(image, digest_size=16).hexdigest()
+
+
+class TemplateCache:
+    """
+    Minutiae of the captures already processed, keyed by `image_key`.
+
+    The `max_entries` most recently used entries are kept in memory. With
+    `disk_dir`, every entry is also written to
+    `<disk_dir>/v<PIPELINE_VERSION>/<key>.npz` so it survives restarts and
+    is shared between processes; directories of other pipeline versions
+    are deleted. Past `max_disk_entries` files, the least recently used
+    ones are deleted. With `keep_images`, the intermediate images are
+    cached too, so a hit does not even recompute them for display.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        disk_dir: Optional[Path] = None,
+        keep_images: bool = False,
+        max_disk_entries: int = 4096,
+    ):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.keep_images = keep_images
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.disk_dir = None
+        if disk_dir is not None:
+            self.disk_dir = disk_dir / f"v{PIPELINE_VERSION}"
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            for version_dir in disk_dir.glob("v*"):
+                if version_dir != self.disk_dir and version_dir.is_dir():
+                    shutil.rmtree(version_dir, ignore_errors=True)
+            self._disk_entries = sum(1 for _ in self.disk_dir.glob("*.npz"))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def fingerprint(
+        self, image: MatLike, features_only: bool = False, persist: bool = True
+    ) -> Fingerprint:
+        """
+        `Fingerprint(image, features_only)`, from the cache if possible.
+        Without `persist`, a new entry is only kept in memory, for one-off
+        captures such as live probes.
+        """
+        key = image_key(image)
+        entry = self.get(key)
+        if entry is not None and (
+            features_only or not self.keep_images or entry.images
+        ):
+            images = {} if features_only else entry.images
+            return Fingerprint.from_minutiae(image, entry.minutiae, **images)
+
+        fp = Fingerprint(image, features_only and not self.keep_images)
+        self.put(key, fp, persist)
+        if features_only:
+            fp.drop_images()
+        return fp
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._load(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.disk_hits += 1
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key: str, fp: Fingerprint, persist: bool = True) -> None:
+        images = {}
+        if self.keep_images:
+            images = {name: getattr(fp, name) for name in CACHED_IMAGES}
+        entry = CacheEntry(fp.minutiae, images)
+        self._remember(key, entry)
+        if persist:
+            self._save(key, entry)
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.npz"
+
+    def _load(self, key: str) -> Optional[CacheEntry]:
+        if self.disk_dir is None:
+            return None
+        try:
+            with np.load(self._path(key)) as npz:
+                data = np.empty(len(npz["x"]), dtype=MINUTIA_DTYPE)
+                for name in MINUTIA_DTYPE.names:
+                    data[name] = npz[name]
+                images = {
+                    name: npz[name] for name in CACHED_IMAGES if name in npz
+                }
+        except (OSError, KeyError, ValueError):
+            return None
+        # Eviction goes by modification time, mark the file as used
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+        return CacheEntry(MinutiaSet(data), images)
+
+    def _save(self, key: str, entry: CacheEntry) -> None:
+        if self.disk_dir is None:
+            return
+        data = entry.minutiae.data
+        path = self._path(key)
+        # Write then rename, a concurrent reader never sees a partial file
+        tmp_path = path.with_suffix(
+            f".{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        with open(tmp_path, "wb") as f:
+            np.savez_compressed(
+                f,
+                **{name: data[name] for name in MINUTIA_DTYPE.names},
+                **entry.images,
+            )
+        tmp_path.replace(path)
+
+        with self._lock:
+            self._disk_entries += 1
+            evict = self._disk_entries > self.max_disk_entries
+        if evict:
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        Delete the least recently used files down to three quarters of
+        `max_disk_entries`, so the directory is not scanned on every save
+        """
+        files = []
+        for path in self.disk_dir.glob("*.npz"):
+            try:
+                files.append((path.stat().st_mtime_ns, path))
+            except OSError:
+                # Evicted by another process meanwhile
+                continue
+        files.sort()
+        excess = max(len(files) - self.max_disk_entries * 3 // 4, 0)
+        for _, path in files[:excess]:
+            path.unlink(missing_ok=True)
+        with self._lock:
+            self._disk_entries = len(files) - excess
+
+
+_shared_caches: dict[tuple[Path, bool], TemplateCache] = {}
+
+
+def shared_cache(disk_dir: Path, keep_images: bool = False) -> TemplateCache:
+    """One cache per process and directory, for worker processes"""
+    key = (disk_dir, keep_images)
+    if key not in _shared_caches:
+        _shared_caches[key] = TemplateCache(
+            disk_dir=disk_dir, keep_images=keep_images
+        )
+    return _shared_caches[key]
@@ -0,0 +1,175 @@
+import hashlib
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from fingerprint_matcher import (
+    Fingerprint,
+    MinutiaSet,
+    enrolled_captures,
+    load_capture,
+    load_template,
+    save_template,
+)
+from gallery import Gallery
+from profiling import profiler
+from template_cache import TemplateCache
+from triplet_index import TripletIndex
+
+# From this many templates on, `identify` preselects candidates with the
+# triplet index instead of scoring the whole gallery
+TRIPLET_MIN_TEMPLATES = 256
+
+
+@dataclass
+class TemplateEntry:
+    name: str
+    minutiae: MinutiaSet
+    mtime_ns: int
+    size: int
+    digest: bytes
+
+
+def file_digest(path: Path) -> bytes:
+    return hashlib.blake2b(path.read_bytes()).digest()
+
+
+class TemplateIndex:
+    """
+    In-memory index of the minutiae templates stored under `db_dir`.
+
+    Every `db/<name>/template.npz` is loaded once; `refresh` only reloads
+    entries whose mtime or size changed and whose content hash differs from
+    the cached one. Enrollments that predate templates (only a capture)
+    get their template extracted and written on the first refresh, through
+    `cache` if given.
+
+    The gallery and the triplet index are built on first use; the triplet
+    index is then kept up to date incrementally, `add` indexes a new
+    enrollment without rescanning `db_dir`.
+    """
+
+    def __init__(self, db_dir: Path, cache: Optional[TemplateCache] = None):
+        self.db_dir = db_dir
+        self.cache = cache
+        self.entries: dict[str, TemplateEntry] = {}
+        self._gallery: Optional[Gallery] = None
+        self._triplets: Optional[TripletIndex] = None
+        # Incremented whenever a template is added, changed or removed
+        self.generation = 0
+        self._lock = threading.RLock()
+
+    @property
+    def gallery(self) -> Gallery:
+        """All templates packed for batched identification"""
+        if self._gallery is None:
+            self._gallery = Gallery.from_templates(
+                (entry.name, entry.minutiae) for entry in self
+            )
+        return self._gallery
+
+    @property
+    def triplets(self) -> TripletIndex:
+        """All templates in an inverted index of minutia triplets"""
+        with self._lock:
+            if self._triplets is None:
+                self._build_triplets()
+            return self._triplets
+
+    def _build_triplets(self) -> None:
+        with profiler.stage("triplet_index_build"):
+            self._triplets = TripletIndex.from_templates(
+                [(entry.name, entry.minutiae) for entry in self]
+            )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __iter__(self) -> Iterator[TemplateEntry]:
+        return iter(self.entries.values())
+
+    def refresh(self) -> None:
+        with self._lock:
+            self._refresh()
+            # Build the triplet index up front rather than on the first
+            # identification, it is kept up to date from then on
+            if (
+                self._triplets is None
+                and len(self) >= TRIPLET_MIN_TEMPLATES
+            ):
+                self._build_triplets()
+
+    def add(self, name: str) -> None:
+        """Load, or reload, the template just saved under `db_dir/name`"""
+        with self._lock:
+            self._update(name, self.db_dir / name / "template.npz")
+
+    def identify(
+        self, probe: MinutiaSet, top_k: int = 5
+    ) -> list[tuple[str, int]]:
+        """
+        Return the `top_k` best (name, score) candidates for the probe,
+        through the triplet index once there are `TRIPLET_MIN_TEMPLATES`
+        templates, else by scoring all of them
+        """
+        with self._lock:
+            if len(self) >= TRIPLET_MIN_TEMPLATES:
+                index = self.triplets
+            else:
+                index = self.gallery
+        return index.identify(probe, top_k=top_k)
+
+    def _refresh(self) -> None:
+        for fp_path in enrolled_captures(self.db_dir).values():
+            template_path = fp_path.parent / "template.npz"
+            if not template_path.exists():
+                img = load_capture(fp_path)
+                if self.cache is not None:
+                    fp = self.cache.fingerprint(img, features_only=True)
+                else:
+                    fp = Fingerprint(img, features_only=True)
+                save_template(template_path, fp.minutiae)
+
+        seen = set()
+        for template_path in self.db_dir.glob("*/template.npz"):
+            name = template_path.parent.name
+            seen.add(name)
+            self._update(name, template_path)
+
+        for name in self.entries.keys() - seen:
+            del self.entries[name]
+            self._gallery = None
+            self.generation += 1
+            if self._triplets is not None:
+                self._triplets.remove(name)
+
+    def _update(self, name: str, template_path: Path) -> None:
+        stat = template_path.stat()
+        entry = self.entries.get(name)
+        if (
+            entry is not None
+            and entry.mtime_ns == stat.st_mtime_ns
+            and entry.size == stat.st_size
+        ):
+            return
+
+        digest = file_digest(template_path)
+        if entry is not None and entry.digest == digest:
+            entry.mtime_ns = stat.st_mtime_ns
+            entry.size = stat.st_size
+            return
+
+        self._gallery = None
+        self.generation += 1
+        with profiler.stage("template_load"):
+            minutiae = load_template(template_path)
+        self.entries[name] = TemplateEntry(
+            name=name,
+            minutiae=minutiae,
+            mtime_ns=stat.st_mtime_ns,
+            size=stat.st_size,
+            digest=digest,
+        )
+        if self._triplets is not None:
+            self._triplets.add(name, minutiae)
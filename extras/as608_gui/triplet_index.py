@@ -0,0 +1,341 @@
+import threading
+from itertools import combinations, product
+from typing import Sequence
+
+import numpy as np
+from numpy.typing import NDArray
+from scipy.spatial import cKDTree
+
+from fingerprint_matcher import (
+    MINUTIA_TYPES,
+    Minutia,
+    MinutiaSet,
+    match_minutiae_vectorized,
+)
+
+# Neighbors of each minutia its triplets are built from
+TRIPLET_NEIGHBORS = 5
+# Side lengths are quantized to bins of this many pixels, and triplets with
+# a longer side than TRIPLET_MAX_SIDE are not indexed
+TRIPLET_BIN = 8
+TRIPLET_MAX_SIDE = 150
+# Terminations' directions, relative to the triangle, are quantized to bins
+# of this many degrees; a bifurcation's direction is not stable enough
+ANGLE_BIN = 45
+# Candidates the votes select for verification by the matcher
+N_CANDIDATES = 10
+# Postings appended since the last merge, as a fraction of the merged ones,
+# before they are merged into the sorted arrays
+MERGE_RATIO = 0.125
+
+_PAIRS = np.array(list(combinations(range(TRIPLET_NEIGHBORS), 2)))
+# Bits of each digit of a key: three sides, three vertex types, three
+# relative angles and the orientation
+_DIGIT_BITS = (6, 6, 6, 1, 1, 1, 3, 3, 3, 1)
+# Digits a probe also looks up in the neighboring bin: sides and angles
+_FUZZY_DIGITS = (0, 1, 2, 6, 7, 8)
+_VARIANTS = np.array(list(product((False, True), repeat=len(_FUZZY_DIGITS))))
+
+
+def triplets(minutiae: MinutiaSet) -> NDArray[np.intp]:
+    """
+    Index triples of the triangles each minutia forms with two of its
+    `TRIPLET_NEIGHBORS` nearest neighbors, each triangle once
+    """
+    n = len(minutiae)
+    if n < 3:
+        return np.empty((0, 3), dtype=np.intp)
+
+    points = np.column_stack([minutiae.data["x"], minutiae.data["y"]])
+    k = min(TRIPLET_NEIGHBORS, n - 1)
+    _, neighbors = cKDTree(points).query(points, k + 1)
+    neighbors = neighbors[:, 1:]
+    pairs = _PAIRS[(_PAIRS < k).all(axis=1)]
+    triangles = np.column_stack(
+        [
+            np.repeat(np.arange(n), len(pairs)),
+            neighbors[:, pairs[:, 0]].reshape(-1),
+            neighbors[:, pairs[:, 1]].reshape(-1),
+        ]
+    )
+    return np.unique(np.sort(triangles, axis=1), axis=0)
+
+
+def triangle_geometry(
+    minutiae: MinutiaSet, triangles: NDArray[np.intp]
+) -> tuple[NDArray[np.float64], NDArray[np.intp], NDArray[np.bool_]]:
+    """
+    Side lengths of each triangle in ascending order, its vertices ordered
+    by the side they face, and its orientation (clockwise or not) in that
+    order: all invariant to translation and rotation.
+    """
+    points = np.column_stack(
+        [minutiae.data["x"], minutiae.data["y"]]
+    ).astype(np.float64)
+    corners = points[triangles]
+    # Side i faces vertex i
+    sides = np.linalg.norm(
+        corners[:, [1, 2, 0]] - corners[:, [2, 0, 1]], axis=2
+    )
+    order = np.argsort(sides, axis=1, kind="stable")
+    rows = np.arange(len(triangles))[:, None]
+    sides = sides[rows, order]
+    vertices = triangles[rows, order]
+
+    a, b, c = (points[vertices[:, i]] for i in range(3))
+    ab, ac = b - a, c - a
+    cross = ab[:, 0] * ac[:, 1] - ab[:, 1] * ac[:, 0]
+    return sides, vertices, cross > 0
+
+
+def triplet_digits(minutiae: MinutiaSet) -> NDArray[np.float64]:
+    """
+    Unquantized digits of every triplet's key, one row per triplet, in
+    bins: side lengths, vertex types, terminations' directions relative to
+    the side to the next vertex, and orientation
+    """
+    triangles = triplets(minutiae)
+    sides, vertices, clockwise = triangle_geometry(minutiae, triangles)
+    points = np.column_stack([minutiae.data["x"], minutiae.data["y"]])
+    types = minutiae.data["type"][vertices]
+    angles = minutiae.data["angle"][vertices].astype(np.float64)
+
+    # Side directions, measured the way the extractor measures minutiae
+    delta = points[np.roll(vertices, -1, axis=1)] - points[vertices]
+    side_angles = -np.degrees(np.arctan2(delta[..., 0], delta[..., 1]))
+    relative = ((angles - side_angles) % 360) / ANGLE_BIN
+    relative[types != MINUTIA_TYPES.index("termination")] = 0
+
+    digits = np.column_stack(
+        [sides / TRIPLET_BIN, types, relative, clockwise]
+    )
+    return digits[sides[:, 2] <= TRIPLET_MAX_SIDE + TRIPLET_BIN]
+
+
+def pack_keys(digits: NDArray[np.int64]) -> NDArray[np.int64]:
+    """Pack quantized digits, the last axis, into one key each"""
+    keys = np.zeros(digits.shape[:-1], dtype=np.int64)
+    for i, bits in enumerate(_DIGIT_BITS):
+        keys = (keys << bits) | np.clip(digits[..., i], 0, (1 << bits) - 1)
+    return keys
+
+
+def template_keys(minutiae: MinutiaSet) -> NDArray[np.int64]:
+    """The distinct keys of a template's triplets"""
+    digits = triplet_digits(minutiae)
+    digits = digits[digits[:, 2] * TRIPLET_BIN <= TRIPLET_MAX_SIDE]
+    return np.unique(pack_keys(np.floor(digits).astype(np.int64)))
+
+
+def probe_keys(minutiae: MinutiaSet) -> NDArray[np.int64]:
+    """
+    Keys to look up for each of a probe's triplets, one row per triplet:
+    every combination of each side and angle's bin and the neighboring bin
+    it is closest to
+    """
+    digits = triplet_digits(minutiae)
+    bins = np.floor(digits).astype(np.int64)
+    nearest = bins.copy()
+    fuzzy = list(_FUZZY_DIGITS)
+    nearest[:, fuzzy] += np.where(
+        digits[:, fuzzy] - bins[:, fuzzy] < 0.5, -1, 1
+    )
+    # Angles wrap around, sides below the first bin match nothing
+    angles = list(_FUZZY_DIGITS[3:])
+    nearest[:, angles] %= 360 // ANGLE_BIN
+
+    variants = np.repeat(bins[:, None], len(_VARIANTS), axis=1)
+    use_nearest = np.zeros((len(_VARIANTS), bins.shape[1]), dtype=bool)
+    use_nearest[:, fuzzy] = _VARIANTS
+    variants = np.where(use_nearest, nearest[:, None], variants)
+    return np.where(
+        (variants >= 0).all(axis=2), pack_keys(np.maximum(variants, 0)), -1
+    )
+
+
+def postings(
+    sorted_keys: NDArray[np.int64],
+    owners: NDArray[np.int32],
+    keys: NDArray[np.int64],
+    key_ids: NDArray[np.intp],
+) -> tuple[NDArray[np.int32], NDArray[np.intp]]:
+    """
+    Every posting of `keys` in `sorted_keys`: its owner, and the id of the
+    key that found it
+    """
+    start = np.searchsorted(sorted_keys, keys, side="left")
+    lengths = np.searchsorted(sorted_keys, keys, side="right") - start
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(lengths.sum()) + np.repeat(start - offsets, lengths)
+    return owners[positions], np.repeat(key_ids, lengths)
+
+
+class TripletIndex:
+    """
+    Inverted index from minutia-triplet keys to the templates containing
+    them, for 1:N identification without scanning every template.
+
+    A template is indexed by the triangles its minutiae form with their
+    nearest neighbors, described by quantized side lengths, vertex types
+    and orientation, which do not change under translation and rotation.
+    A probe's triplets vote for the templates sharing their keys, and only
+    the `N_CANDIDATES` best voted go to the matcher.
+
+    Postings are kept as a sorted key array plus a short unsorted tail of
+    recent insertions, so `add` is cheap; the tail is merged once it grows
+    past `MERGE_RATIO` of the sorted part. Removed templates stay in the
+    postings and are filtered out of the votes.
+    """
+
+    def __init__(self):
+        self.names: list[str] = []
+        self.templates: list[MinutiaSet] = []
+        self.alive: list[bool] = []
+        self.n_keys: list[int] = []
+        self._ids: dict[str, int] = {}
+        self._keys = np.empty(0, dtype=np.int64)
+        self._owners = np.empty(0, dtype=np.int32)
+        self._tail_keys: list[NDArray[np.int64]] = []
+        self._tail_owners: list[NDArray[np.int32]] = []
+        self._tail_size = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_templates(
+        cls, templates: Sequence[tuple[str, Sequence[Minutia]]]
+    ) -> "TripletIndex":
+        index = cls()
+        for name, minutiae in templates:
+            index._append(name, MinutiaSet.from_minutiae(minutiae))
+        index._merge()
+        return index
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def add(self, name: str, minutiae: Sequence[Minutia]) -> None:
+        """Index a template, replacing any previous one of `name`"""
+        minutiae = MinutiaSet.from_minutiae(minutiae)
+        with self._lock:
+            self._append(name, minutiae)
+            if self._tail_size > MERGE_RATIO * len(self._keys):
+                self._merge()
+
+    def _append(self, name: str, minutiae: MinutiaSet) -> None:
+        keys = template_keys(minutiae)
+        self._remove(name)
+        template_id = len(self.names)
+        self._ids[name] = template_id
+        self.names.append(name)
+        self.templates.append(minutiae)
+        self.alive.append(True)
+        self.n_keys.append(len(keys))
+
+        self._tail_keys.append(keys)
+        self._tail_owners.append(
+            np.full(len(keys), template_id, dtype=np.int32)
+        )
+        self._tail_size += len(keys)
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            self._remove(name)
+
+    def _remove(self, name: str) -> None:
+        template_id = self._ids.pop(name, None)
+        if template_id is not None:
+            self.alive[template_id] = False
+            self.templates[template_id] = MinutiaSet()
+
+    def _merge(self) -> None:
+        if not self._tail_keys:
+            return
+        keys = np.concatenate([self._keys, *self._tail_keys])
+        owners = np.concatenate([self._owners, *self._tail_owners])
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._owners = owners[order]
+        self._tail_keys.clear()
+        self._tail_owners.clear()
+        self._tail_size = 0
+
+    def votes(self, probe: Sequence[Minutia]) -> NDArray[np.float64]:
+        """
+        Per template, how many of the probe's triplets it shares,
+        normalized by the square root of its own number of triplets so
+        that large templates do not win by size alone
+        """
+        probe = MinutiaSet.from_minutiae(probe)
+        keys = probe_keys(probe)
+        probe_triplets = np.repeat(np.arange(len(keys)), keys.shape[1])
+        keys = keys.reshape(-1)
+
+        with self._lock:
+            n_templates = len(self.names)
+            if n_templates == 0:
+                return np.zeros(0)
+
+            tail_keys = np.concatenate(
+                [np.empty(0, np.int64), *self._tail_keys]
+            )
+            tail_owners = np.concatenate(
+                [np.empty(0, np.int32), *self._tail_owners]
+            )
+            tail_order = np.argsort(tail_keys, kind="stable")
+            owners, triplet_ids = (
+                np.concatenate(arrays)
+                for arrays in zip(
+                    postings(self._keys, self._owners, keys, probe_triplets),
+                    postings(
+                        tail_keys[tail_order],
+                        tail_owners[tail_order],
+                        keys,
+                        probe_triplets,
+                    ),
+                )
+            )
+            alive = np.array(self.alive)
+            n_keys = np.array(self.n_keys)
+
+        # A triplet votes once per template, however many of its keys hit
+        if len(owners) == 0:
+            return np.zeros(n_templates)
+        pairs = np.sort(triplet_ids.astype(np.int64) * n_templates + owners)
+        pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+        counts = np.bincount(pairs % n_templates, minlength=n_templates)
+        counts[~alive] = 0
+        return counts / np.sqrt(np.maximum(n_keys, 1))
+
+    def candidates(
+        self, probe: Sequence[Minutia], n_candidates: int = N_CANDIDATES
+    ) -> list[int]:
+        """Ids of the `n_candidates` templates with the most votes"""
+        votes = self.votes(probe)
+        n_candidates = min(n_candidates, np.count_nonzero(votes))
+        if n_candidates == 0:
+            return []
+        best = np.argpartition(-votes, n_candidates - 1)[:n_candidates]
+        return best[np.argsort(-votes[best], kind="stable")].tolist()
+
+    def identify(
+        self,
+        probe: Sequence[Minutia],
+        top_k: int = 5,
+        n_candidates: int = N_CANDIDATES,
+    ) -> list[tuple[str, int]]:
+        """
+        Return the `top_k` best (name, score) candidates for the probe,
+        scoring only the best voted templates with the matcher
+        """
+        scores = [
+            (
+                self.names[t],
+                match_minutiae_vectorized(self.templates[t], probe),
+            )
+            for t in self.candidates(probe, n_candidates)
+        ]
+        scores.sort(key=lambda candidate: -candidate[1])
+        return scores[:top_k]
@@ -54,6 +54,8 @@ enum CommandCode : uint8_t {
     // self-defined command codes
     Acknowledgement = 0x30,
     PrintDeviceParameters = 0x31,
+    SetBaudRate = 0x32,
+    UpImageCompressed = 0x33,
 };
 
 enum ConfirmationCode : uint8_t {
@@ -15,8 +15,24 @@ enum DeviceState : uint8_t {
 
     DataStart = 0x07,
     DataEnd = 0x08,
+    // Starts a frame of delta-coded pixels, in reply to UpImageCompressed
+    CompressedData = 0x09,
 
     Idle = 0x69,
 };
 
+// Host link rates selectable with CommandCode::SetBaudRate, by index. The
+// link always starts at the first one.
+const uint32_t BaudRates[] = {57600, 115200, 250000, 500000, 1000000};
+const uint8_t BaudRateCount = sizeof(BaudRates) / sizeof(BaudRates[0]);
+
+// How long to wait for the host's Acknowledgement at a new rate before
+// falling back to the previous one
+const unsigned long BaudRateAckTimeout = 1000;
+
+// 2-bit code of the difference between two 4-bit pixels in a
+// CompressedData frame (0, +1 and -1); any other difference is escaped and
+// sent as a nibble after the codes
+const uint8_t DeltaEscape = 2;
+
 }  // namespace Controller